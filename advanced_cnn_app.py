@@ -5,16 +5,50 @@ Professional system with detailed student information display
 """
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
 import cv2
 import numpy as np
-import io
-from PIL import Image
-from typing import Dict, Any
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
 from backend.advanced_cnn_recognition import advanced_cnn_recognizer
 import sqlite3
 
-app = FastAPI(title="🧠 Advanced CNN Face Recognition System")
+app = FastAPI(title="🧠 Advanced CNN Face Recognition System", default_response_class=ORJSONResponse)
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
+# Longest image side handed to the recognizer; CNN embedders work at ~224px anyway
+MAX_IMAGE_SIDE = 1024
+
+# Upload size limit and read chunk size
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Leading bytes of formats cv2.imdecode accepts (JPEG, PNG, BMP, little/big-endian TIFF);
+# WebP is RIFF....WEBP and checked separately. imdecode remains the real validator.
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'BM', b'II*\x00', b'MM\x00*')
+
+# Students processed per recognizer batch when rebuilding the CNN database
+REBUILD_BATCH_SIZE = 32
+
+# Concurrent recognitions are collected into one CNN forward pass of up to MAX_BATCH
+# images, waiting at most MAX_HOLD_SECONDS for the batch to fill
+MAX_BATCH = 8
+MAX_HOLD_SECONDS = 0.010
+recognition_queue: Optional["asyncio.Queue[Tuple[np.ndarray, asyncio.Future]]"] = None
+recognition_batcher: Optional[asyncio.Task] = None
+
+# Recognition results keyed by upload content hash, each stored with the gallery
+# generation it was scored against; entries from an older gallery are ignored
+RECOGNITION_CACHE_SIZE = 1024
+recognition_cache: "OrderedDict[str, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+
+# Shared SQLite connection (queries run in worker threads)
+db_conn = sqlite3.connect('attendance.db', check_same_thread=False)
+db_conn.execute('PRAGMA journal_mode=WAL')
+db_conn.execute('PRAGMA synchronous=NORMAL')
 
 # Professional HTML template with detailed display
 ADVANCED_HTML_TEMPLATE = """
@@ -402,34 +436,142 @@ ADVANCED_HTML_TEMPLATE = """
 </html>
 """
 
+# Encode the page once instead of on every request
+ADVANCED_HTML_BYTES = ADVANCED_HTML_TEMPLATE.encode('utf-8')
+
+@app.on_event("startup")
+async def warmup_cnn_model():
+    """Push a dummy image through the recognizer so model loading happens before user traffic"""
+    dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+    await asyncio.to_thread(advanced_cnn_recognizer.recognize_face_from_image, dummy)
+
+async def recognition_batch_worker():
+    """Collect queued recognitions into batches and embed each batch in one forward pass"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await recognition_queue.get()]
+        deadline = loop.time() + MAX_HOLD_SECONDS
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(recognition_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        images = [image for image, _ in batch]
+        try:
+            results = await asyncio.to_thread(advanced_cnn_recognizer.recognize_faces_batch, images)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+async def recognize_batched(image: np.ndarray) -> Dict[str, Any]:
+    """Queue an image for batched CNN recognition and wait for its result"""
+    future = asyncio.get_running_loop().create_future()
+    await recognition_queue.put((image, future))
+    return await future
+
+@app.on_event("startup")
+async def start_recognition_batcher():
+    """Start the background task that batches recognition requests"""
+    global recognition_queue, recognition_batcher
+    recognition_queue = asyncio.Queue()
+    recognition_batcher = asyncio.create_task(recognition_batch_worker())
+
+@app.on_event("shutdown")
+async def stop_recognition_batcher():
+    """Cancel the batching task and any recognitions still waiting in the queue"""
+    if recognition_batcher is not None:
+        recognition_batcher.cancel()
+        try:
+            await recognition_batcher
+        except asyncio.CancelledError:
+            pass
+    while recognition_queue is not None and not recognition_queue.empty():
+        _, future = recognition_queue.get_nowait()
+        future.cancel()
+
+def with_fresh_student_details(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a cached recognition result with its student details re-read from the database"""
+    result = dict(result)
+    if result.get('match_found'):
+        result['student_details'] = advanced_cnn_recognizer.get_student_details(result['student_id'])
+    elif result.get('best_rejected_match'):
+        rejected = dict(result['best_rejected_match'])
+        rejected['student_details'] = advanced_cnn_recognizer.get_student_details(rejected['student_id'])
+        result['best_rejected_match'] = rejected
+    return result
+
 @app.get("/", response_class=HTMLResponse)
 async def get_advanced_page():
     """Serve the advanced CNN recognition page"""
-    return ADVANCED_HTML_TEMPLATE
+    return Response(
+        content=ADVANCED_HTML_BYTES,
+        media_type="text/html",
+        headers={"Cache-Control": "public, max-age=3600"}
+    )
 
 @app.post("/cnn-recognition")
 async def cnn_face_recognition(file: UploadFile = File(...)):
     """Advanced CNN face recognition with comprehensive student details"""
     
     try:
-        # Read uploaded file
-        contents = await file.read()
-        
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        # Convert to OpenCV format
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        
-        # CNN recognition
-        result = advanced_cnn_recognizer.recognize_face_from_image(cv_image)
+        # Read uploaded file in chunks, rejecting oversized uploads early
+        contents = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            contents.extend(chunk)
+            if len(contents) > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Image too large")
+        
+        # Reject non-image uploads before hashing or decoding
+        is_webp = contents[:4] == b'RIFF' and contents[8:12] == b'WEBP'
+        if not (contents.startswith(IMAGE_SIGNATURES) or is_webp):
+            raise HTTPException(status_code=415, detail="Unsupported image format")
+        
+        # Re-uploads of the same photo reuse the previous result while the gallery is unchanged
+        cache_key = hashlib.blake2b(contents, digest_size=16).hexdigest()
+        generation = advanced_cnn_recognizer.gallery_generation
+        cached = recognition_cache.get(cache_key)
+        if cached is not None and cached[0] == generation:
+            recognition_cache.move_to_end(cache_key)
+            # Student rows can change without a rebuild, so details are always read fresh
+            return await asyncio.to_thread(with_fresh_student_details, cached[1])
+        
+        # Decode straight into a BGR array (EXIF orientation is applied by imdecode)
+        cv_image = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if cv_image is None:
+            raise HTTPException(status_code=400, detail="Undecodable image")
+        
+        # Downscale large phone photos before detection
+        height, width = cv_image.shape[:2]
+        scale = min(1.0, MAX_IMAGE_SIDE / max(height, width))
+        if scale < 1.0:
+            cv_image = cv2.resize(cv_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        # CNN recognition, batched with concurrent requests in a worker thread
+        result = await recognize_batched(cv_image)
+        
+        if not str(result.get('reason', '')).startswith('Error'):
+            recognition_cache[cache_key] = (generation, result)
+            recognition_cache.move_to_end(cache_key)
+            if len(recognition_cache) > RECOGNITION_CACHE_SIZE:
+                recognition_cache.popitem(last=False)
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
@@ -442,12 +584,12 @@ async def get_system_stats():
 async def rebuild_cnn_database():
     """Rebuild CNN face database from student records"""
     try:
-        # Get students from database
-        conn = sqlite3.connect('attendance.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT student_id, name, photo_url FROM students WHERE photo_url IS NOT NULL ORDER BY student_id')
-        students = cursor.fetchall()
-        conn.close()
+        # Get students from database without blocking the event loop
+        students = await asyncio.to_thread(
+            lambda: db_conn.execute(
+                'SELECT student_id, name, photo_url FROM students WHERE photo_url IS NOT NULL ORDER BY student_id'
+            ).fetchall()
+        )
         
         results = {
             'total_students': len(students),
@@ -456,14 +598,23 @@ async def rebuild_cnn_database():
             'details': []
         }
         
-        for student_id, name, photo_url in students:
-            success = advanced_cnn_recognizer.extract_and_save_face(photo_url, str(student_id))
-            if success:
-                results['successful'] += 1
-                results['details'].append(f"✅ {name} (ID: {student_id})")
-            else:
-                results['failed'] += 1
-                results['details'].append(f"❌ {name} (ID: {student_id})")
+        for start in range(0, len(students), REBUILD_BATCH_SIZE):
+            chunk = students[start:start + REBUILD_BATCH_SIZE]
+            outcomes = await asyncio.to_thread(
+                advanced_cnn_recognizer.extract_and_save_faces_batch,
+                [(photo_url, str(student_id)) for student_id, _, photo_url in chunk]
+            )
+            
+            for student_id, name, _ in chunk:
+                if outcomes.get(str(student_id)):
+                    results['successful'] += 1
+                    results['details'].append(f"✅ {name} (ID: {student_id})")
+                else:
+                    results['failed'] += 1
+                    results['details'].append(f"❌ {name} (ID: {student_id})")
+        
+        # Each published batch already outdates older entries; drop them all once the gallery is final
+        recognition_cache.clear()
         
         return results
         
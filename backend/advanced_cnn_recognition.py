@@ -8,10 +8,18 @@ import cv2
 import numpy as np
 import logging
 import json
+import hashlib
+import pickle
 import os
+import ctypes
+import threading
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Union, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 from io import BytesIO
 import sqlite3
@@ -24,6 +32,125 @@ except ImportError:
     DEEPFACE_AVAILABLE = False
     print("⚠️ DeepFace not available, using fallback CNN implementation")
 
+# Optional approximate nearest-neighbour search over enrolled encodings
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+# Optional ONNX Runtime backend for the CNN model
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+# Optional JIT compilation for the LBP kernel
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Optional compiled SIMD LBP kernel (build command in lbp_simd.c)
+try:
+    _lbp_simd = ctypes.CDLL(str(Path(__file__).with_name('lbp_simd.so')))
+    _lbp_simd.lbp_kernel.restype = None
+    _lbp_simd.lbp_kernel.argtypes = [
+        ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+        ctypes.c_void_p
+    ]
+    LBP_SIMD_AVAILABLE = True
+except OSError:
+    LBP_SIMD_AVAILABLE = False
+
+@lru_cache(maxsize=None)
+def _lbp_coordinates(radius: int, n_points: int, rows: int, cols: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Neighbour row/col lookup tables for an LBP ring, shape (n_points, rows) and (n_points, cols).
+    
+    Computed per row/col as int(i + radius * cos(angle)) so float rounding
+    matches the original per-pixel implementation exactly.
+    """
+    angles = 2 * np.pi * np.arange(n_points) / n_points
+    xs = (np.arange(rows)[None, :] + radius * np.cos(angles)[:, None]).astype(np.int64)
+    ys = (np.arange(cols)[None, :] + radius * np.sin(angles)[:, None]).astype(np.int64)
+    return np.clip(xs, 0, rows - 1), np.clip(ys, 0, cols - 1)
+
+def _lbp_vectorized(image: np.ndarray, xs: np.ndarray, ys: np.ndarray, radius: int) -> np.ndarray:
+    """LBP over the interior of a uint8 image, one array comparison per neighbour"""
+    rows, cols = image.shape
+    lbp = np.zeros((rows, cols), dtype=np.uint8)
+    inner_rows = slice(radius, rows - radius)
+    inner_cols = slice(radius, cols - radius)
+    center = image[inner_rows, inner_cols]
+    pattern = lbp[inner_rows, inner_cols]
+    
+    for p in range(xs.shape[0]):
+        neighbors = image[np.ix_(xs[p, inner_rows], ys[p, inner_cols])]
+        pattern |= (neighbors >= center).astype(np.uint8) << p
+    
+    return lbp
+
+def _lbp_simd_kernel(image: np.ndarray, xs: np.ndarray, ys: np.ndarray, radius: int) -> np.ndarray:
+    """LBP through the compiled AVX2 kernel (up to 8 neighbours)"""
+    rows, cols = image.shape
+    lbp = np.zeros((rows, cols), dtype=np.uint8)
+    _lbp_simd.lbp_kernel(
+        image.ctypes.data, rows, cols,
+        xs.ctypes.data, ys.ctypes.data, xs.shape[0], radius,
+        lbp.ctypes.data
+    )
+    return lbp
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _lbp_kernel(image: np.ndarray, xs: np.ndarray, ys: np.ndarray, radius: int) -> np.ndarray:
+        """Per-pixel LBP over the interior of a uint8 image"""
+        rows, cols = image.shape
+        lbp = np.zeros((rows, cols), dtype=np.uint8)
+        for i in prange(radius, rows - radius):
+            for j in range(radius, cols - radius):
+                center = image[i, j]
+                pattern = 0
+                for p in range(xs.shape[0]):
+                    if image[xs[p, i], ys[p, j]] >= center:
+                        pattern |= (1 << p)
+                lbp[i, j] = pattern
+        return lbp
+else:
+    _lbp_kernel = _lbp_vectorized
+
+# Length of the multi-scale LBP histogram block at the start of the fallback features (4 radii x 256 bins)
+LBP_FEATURE_LENGTH = 4 * 256
+
+# Neighbour (row, col) block offsets for multi-block LBP, same angular order as calculate_lbp
+BLOCK_LBP_NEIGHBORS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+
+class EncodingIndex(NamedTuple):
+    """Immutable snapshot of the enrolled encodings and the structures searched over them"""
+    encodings: Dict[str, np.ndarray] = {}
+    matrix: Optional[np.ndarray] = None  # Normalized float32 rows, same order as ids
+    ids: Tuple[str, ...] = ()
+    rows: Dict[str, int] = {}
+    search_index: object = None  # Faiss index over matrix, when installed
+    generation: int = 0  # Bumped on every publish
+
+def _encodings_version(ids: List[str], lengths: np.ndarray, values: np.ndarray) -> str:
+    """Short digest of one saved set of encodings, used to match the matrix built from them"""
+    digest = hashlib.sha1(json.dumps(ids).encode('utf-8'))
+    digest.update(np.ascontiguousarray(lengths, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(values, dtype=np.float16).tobytes())
+    return digest.hexdigest()[:16]
+
+STUDENT_DETAILS_SQL = '''
+    SELECT student_id, roll_number, name, class_name, section, branch, 
+           photo_url, is_active, created_at, updated_at
+    FROM students 
+    WHERE student_id = ?
+'''
+
 class AdvancedCNNFaceRecognition:
     """Advanced CNN-based face recognition with multiple models"""
     
@@ -35,40 +162,177 @@ class AdvancedCNNFaceRecognition:
         self.model_name = "VGG-Face"  # Options: VGG-Face, Facenet, OpenFace, DeepFace, DeepID, ArcFace
         self.detector_backend = "opencv"  # Options: opencv, ssd, dlib, mtcnn, retinaface
         self.distance_metric = "cosine"  # Options: cosine, euclidean, euclidean_l2
+        self.inference_backend = "deepface"  # Options: deepface, onnx (ONNX Runtime, CUDA when available; rebuild encodings after switching)
+        self.lbp_variant = "pixel"  # Options: pixel, block (integral-image multi-block LBP; rebuild encodings after switching)
         
         # Recognition thresholds (more permissive for real-world use)
         self.VERIFICATION_THRESHOLD = 0.65  # 65% similarity for verification
         self.HIGH_CONFIDENCE_THRESHOLD = 0.75  # 75% for high confidence
         self.REJECT_THRESHOLD = 0.45  # Below 45% is rejected
         
+        # Concurrent photo downloads when enrolling in batches
+        self.DOWNLOAD_WORKERS = 8
+        
+        # Long-lived pool for fallback feature extraction; its OpenCV/NumPy calls
+        # release the GIL, so threads use every core without re-importing the module
+        self._feature_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        
+        # Nearest-neighbour search settings (used when Faiss is installed)
+        self.SEARCH_TOP_K = 10  # Candidates re-scored exactly per recognition
+        self.IVF_MIN_STUDENTS = 1000  # Below this an exact flat index is used
+        
+        # Search structures are built off to the side and published as one snapshot,
+        # so recognition threads never read a half-rebuilt matrix
+        self._index = EncodingIndex()
+        self._enroll_lock = threading.Lock()  # One enrollment or rebuild at a time
+        
+        # LBP descriptors of enrolled faces, computed on first use for queries the CNN could not embed
+        self._lbp_centroids = {}
+        
         # Storage
         self.face_encodings = {}
         self.face_data = {}
         
         # File paths
-        self.encodings_file = Path("cnn_face_encodings.json")
-        self.face_data_file = Path("cnn_face_data.json")
+        self.encodings_file = Path("cnn_face_encodings.npz")
+        self.legacy_encodings_file = Path("cnn_face_encodings.json")  # Migrated on first load
+        self.matrix_file = Path("cnn_encoding_matrix.npy")  # Base name; each version is saved as cnn_encoding_matrix.<version>.npy
+        self.matrix_manifest_file = Path("cnn_encoding_matrix.json")  # Current version and its ids
+        self._encodings_version = None  # Digest of the saved encodings the matrix is derived from
+        self.onnx_model_file = Path(f"cnn_face_{self.model_name}.onnx")
+        self.face_data_file = Path("cnn_face_data.pkl")
+        self.legacy_face_data_file = Path("cnn_face_data.json")  # Migrated on first load; also the debug export
+        
+        # Pooled HTTP session so photo downloads reuse keep-alive connections
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                              max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+        self._http.mount('https://', adapter)
+        self._http.mount('http://', adapter)
+        
+        # Shared database connection for student lookups (guarded for request threads)
+        self._db = sqlite3.connect('attendance.db', check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db_lock = threading.Lock()
         
         # Load existing data
         self.load_face_data()
         self.load_face_encodings()
+        self._rebuild_matrix(use_saved=True)
         
         logging.basicConfig(level=logging.INFO)
         
+        if NUMBA_AVAILABLE:
+            # Compile the LBP kernel now rather than on the first request
+            self.calculate_lbp(np.zeros((16, 16), dtype=np.uint8), 1, 8)
+        
+        # Prebuilt DeepFace model and optional ONNX Runtime session
+        self._df_model = None
+        self._ort = None
+        
         if DEEPFACE_AVAILABLE:
+            self._configure_inference_precision()
+            self._load_deepface_model()
+            self._load_onnx_session()
             logging.info(f"✅ DeepFace CNN System Initialized with {self.model_name}")
         else:
             logging.info("⚠️ Using fallback CNN implementation")
     
-    def extract_cnn_features(self, image_path: str) -> Optional[np.ndarray]:
-        """Extract CNN features using DeepFace or fallback method"""
+    def _configure_inference_precision(self):
+        """Run the DeepFace backbone in reduced precision when a GPU is present"""
+        try:
+            import tensorflow as tf
+            
+            if not tf.config.list_physical_devices('GPU'):
+                return
+            
+            # TF32 matmuls plus FP16 compute with FP32 weights (Tensor Core paths)
+            tf.config.experimental.enable_tensor_float_32_execution(True)
+            tf.keras.mixed_precision.set_global_policy('mixed_float16')
+            logging.info("⚡ GPU detected, CNN inference using mixed FP16 precision")
+            
+        except Exception as e:
+            logging.warning(f"Could not configure reduced-precision inference: {e}")
+    
+    def _load_deepface_model(self):
+        """Build the DeepFace model once; enrollment and recognition both embed through it"""
+        self._df_model = None
+        try:
+            self._df_model = DeepFace.build_model(self.model_name)
+            self._keras_model = getattr(self._df_model, 'model', self._df_model)
+            self._cnn_input_size = tuple(self._keras_model.input_shape[1:3])  # (height, width)
+        except Exception as e:
+            logging.warning(f"Could not preload DeepFace model {self.model_name}: {e}")
+    
+    def _load_onnx_session(self):
+        """Export the DeepFace model to ONNX (once) and open an ONNX Runtime session"""
+        self._ort = None
+        if self.inference_backend != "onnx" or not ONNXRUNTIME_AVAILABLE or self._df_model is None:
+            return
+        
+        try:
+            if not self.onnx_model_file.exists():
+                import tf2onnx
+                tf2onnx.convert.from_keras(self._keras_model, output_path=str(self.onnx_model_file))
+            
+            self._ort = ort.InferenceSession(
+                str(self.onnx_model_file),
+                providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
+            )
+            self._ort_input_name = self._ort.get_inputs()[0].name
+            logging.info(f"⚡ ONNX Runtime backend ready ({self._ort.get_providers()[0]})")
+            
+        except Exception as e:
+            logging.warning(f"ONNX Runtime backend unavailable, using DeepFace: {e}")
+            self._ort = None
+    
+    def _prepare_face(self, image: Union[str, np.ndarray]) -> Optional[np.ndarray]:
+        """Detect the main face and letterbox it to the CNN input size (RGB, scaled to [0, 1])"""
+        faces = DeepFace.extract_faces(
+            img_path=image,
+            detector_backend=self.detector_backend,
+            enforce_detection=False
+        )
+        if not faces:
+            return None
+        
+        face = faces[0]['face']
+        height, width = self._cnn_input_size
+        scale = min(height / face.shape[0], width / face.shape[1])
+        resized = cv2.resize(face, (max(1, int(face.shape[1] * scale)), max(1, int(face.shape[0] * scale))))
+        
+        # Pad to the exact input size, keeping the aspect ratio as DeepFace does
+        prepared = np.zeros((height, width, 3), dtype=np.float32)
+        top = (height - resized.shape[0]) // 2
+        left = (width - resized.shape[1]) // 2
+        prepared[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+        return prepared
+    
+    def _embed_faces(self, faces: List[np.ndarray]) -> np.ndarray:
+        """Run prepared faces through the CNN in a single batched forward pass"""
+        batch = np.stack(faces).astype(np.float32)
+        if self._ort is not None:
+            return self._ort.run(None, {self._ort_input_name: batch})[0]
+        return self._keras_model.predict(batch, batch_size=32, verbose=0)
+    
+    def _extract_model_features(self, image: Union[str, np.ndarray]) -> Optional[np.ndarray]:
+        """Detect and embed one face exactly as bulk enrollment does, so both land in one space"""
+        face = self._prepare_face(image)
+        return None if face is None else self._embed_faces([face])[0]
+    
+    def extract_cnn_features(self, image: Union[str, np.ndarray]) -> Optional[np.ndarray]:
+        """Extract CNN features (from a file path or BGR array) using DeepFace or fallback method"""
         try:
             if DEEPFACE_AVAILABLE:
                 # Use DeepFace for advanced CNN feature extraction
                 try:
-                    # Generate face embedding using CNN model
+                    if self._df_model is not None:
+                        return self._extract_model_features(image)
+                    
+                    # Model could not be preloaded, so let DeepFace build it
                     embedding = DeepFace.represent(
-                        img_path=image_path,
+                        img_path=image,
                         model_name=self.model_name,
                         detector_backend=self.detector_backend,
                         enforce_detection=False  # Don't fail if face detection is uncertain
@@ -82,19 +346,22 @@ class AdvancedCNNFaceRecognition:
                         
                 except Exception as e:
                     logging.warning(f"DeepFace extraction failed, using fallback: {e}")
-                    return self.extract_fallback_features(image_path)
+                    return self.extract_fallback_features(image)
             else:
-                return self.extract_fallback_features(image_path)
+                return self.extract_fallback_features(image)
                 
         except Exception as e:
             logging.error(f"Error extracting CNN features: {e}")
             return None
     
-    def extract_fallback_features(self, image_path: str) -> Optional[np.ndarray]:
+    def extract_fallback_features(self, image: Union[str, np.ndarray]) -> Optional[np.ndarray]:
         """Fallback CNN-inspired feature extraction using OpenCV"""
         try:
-            # Load image
-            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            # Load image (file path or in-memory BGR array)
+            if isinstance(image, np.ndarray):
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            else:
+                image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
             if image is None:
                 return None
             
@@ -110,38 +377,41 @@ class AdvancedCNNFaceRecognition:
             features = []
             
             # 1. Local Binary Patterns (multiple scales)
+            if self.lbp_variant == "block":
+                integral = cv2.integral((image * 255).astype(np.uint8))
             for radius in [1, 2, 3, 4]:
-                lbp = self.calculate_lbp(image, radius, 8)
-                lbp_hist, _ = np.histogram(lbp.ravel(), bins=256, range=(0, 256))
-                lbp_hist = lbp_hist.astype(float)
+                if self.lbp_variant == "block":
+                    lbp = self.calculate_block_lbp(integral, radius)
+                else:
+                    lbp = self.calculate_lbp(image, radius, 8)
+                lbp_hist = np.bincount(lbp.ravel(), minlength=256).astype(float)
                 lbp_hist /= (lbp_hist.sum() + 1e-7)
                 features.extend(lbp_hist)
             
             # 2. Histogram of Oriented Gradients (HOG)
-            grad_x = cv2.Sobel(image, cv2.CV_64F, 1, 0, ksize=3)
-            grad_y = cv2.Sobel(image, cv2.CV_64F, 0, 1, ksize=3)
-            magnitude = np.sqrt(grad_x**2 + grad_y**2)
-            direction = np.arctan2(grad_y, grad_x)
-            
-            # HOG features
-            mag_hist, _ = np.histogram(magnitude.ravel(), bins=64, range=(0, 1))
-            dir_hist, _ = np.histogram(direction.ravel(), bins=64, range=(-np.pi, np.pi))
+            grad_x = cv2.Sobel(image, cv2.CV_32F, 1, 0, ksize=3)
+            grad_y = cv2.Sobel(image, cv2.CV_32F, 0, 1, ksize=3)
+            magnitude, direction = cv2.cartToPolar(grad_x, grad_y)
+            direction[direction > np.pi] -= 2 * np.pi  # [0, 2pi) -> (-pi, pi] like arctan2
+            
+            # HOG features (64 bins over [0, 1] and [-pi, pi]; magnitudes above 1 are dropped)
+            mag_bins = (magnitude * 64).astype(np.int32)
+            mag_bins[magnitude == 1.0] = 63
+            mag_hist = np.bincount(mag_bins.ravel(), minlength=64)[:64]
+            dir_bins = np.minimum(((direction + np.pi) * (64 / (2 * np.pi))).astype(np.int32), 63)
+            dir_hist = np.bincount(dir_bins.ravel(), minlength=64)
             features.extend(mag_hist / (mag_hist.sum() + 1e-7))
             features.extend(dir_hist / (dir_hist.sum() + 1e-7))
             
-            # 3. Regional features (grid-based)
+            # 3. Regional features (8x8 grid of 28x28 tiles, row-major)
             h, w = image.shape
-            for i in range(0, h, h//8):
-                for j in range(0, w, w//8):
-                    region = image[i:i+h//8, j:j+w//8]
-                    if region.size > 0:
-                        # Statistical features
-                        features.extend([
-                            np.mean(region),
-                            np.std(region),
-                            np.min(region),
-                            np.max(region)
-                        ])
+            tiles = image.reshape(8, h // 8, 8, w // 8).swapaxes(1, 2).reshape(64, -1)
+            features.extend(np.stack([
+                tiles.mean(axis=1),
+                tiles.std(axis=1),
+                tiles.min(axis=1),
+                tiles.max(axis=1)
+            ], axis=1).ravel())
             
             return np.array(features)
             
@@ -156,55 +426,49 @@ class AdvancedCNNFaceRecognition:
             if image.dtype != np.uint8:
                 image = (image * 255).astype(np.uint8)
                 
-            rows, cols = image.shape
-            lbp = np.zeros((rows, cols), dtype=np.uint8)
-            
-            for i in range(radius, rows - radius):
-                for j in range(radius, cols - radius):
-                    center = image[i, j]
-                    pattern = 0
-                    
-                    for p in range(n_points):
-                        # Calculate neighbor coordinates
-                        angle = 2 * np.pi * p / n_points
-                        x = int(i + radius * np.cos(angle))
-                        y = int(j + radius * np.sin(angle))
-                        
-                        # Ensure coordinates are within bounds
-                        x = max(0, min(rows-1, x))
-                        y = max(0, min(cols-1, y))
-                        
-                        # Compare with center and build pattern
-                        if image[x, y] >= center:
-                            pattern |= (1 << p)
-                    
-                    lbp[i, j] = pattern
-            
-            return lbp
+            xs, ys = _lbp_coordinates(radius, n_points, *image.shape)
+            if LBP_SIMD_AVAILABLE and n_points <= 8:
+                return _lbp_simd_kernel(np.ascontiguousarray(image), xs, ys, radius)
+            return _lbp_kernel(np.ascontiguousarray(image), xs, ys, radius)
             
         except Exception as e:
             logging.error(f"Error calculating LBP: {e}")
             return np.zeros_like(image, dtype=np.uint8)
     
+    def calculate_block_lbp(self, integral: np.ndarray, block: int) -> np.ndarray:
+        """Calculate multi-block LBP from an integral image (8 neighbour block sums vs the centre block)"""
+        # Sum of every block x block window, indexed by its top-left corner
+        sums = (integral[block:, block:] - integral[:-block, block:]
+                - integral[block:, :-block] + integral[:-block, :-block])
+        
+        out_rows = sums.shape[0] - 2 * block
+        out_cols = sums.shape[1] - 2 * block
+        center = sums[block:block + out_rows, block:block + out_cols]
+        lbp = np.zeros(center.shape, dtype=np.uint8)
+        
+        for p, (dr, dc) in enumerate(BLOCK_LBP_NEIGHBORS):
+            r0 = block + dr * block
+            c0 = block + dc * block
+            neighbor = sums[r0:r0 + out_rows, c0:c0 + out_cols]
+            lbp |= (neighbor >= center).astype(np.uint8) << p
+        
+        return lbp
+    
+    def normalize_encoding(self, encoding: np.ndarray) -> np.ndarray:
+        """Return a float32, L2-normalized copy of a face encoding"""
+        encoding = np.asarray(encoding, dtype=np.float32)
+        return encoding / (np.linalg.norm(encoding) + 1e-7)
+    
     def calculate_similarity(self, encoding1: np.ndarray, encoding2: np.ndarray) -> float:
-        """Calculate similarity between two face encodings"""
+        """Calculate similarity between two L2-normalized face encodings"""
         try:
-            # Normalize encodings
-            encoding1 = encoding1 / (np.linalg.norm(encoding1) + 1e-7)
-            encoding2 = encoding2 / (np.linalg.norm(encoding2) + 1e-7)
-            
-            if self.distance_metric == "cosine":
-                # Cosine similarity
-                similarity = np.dot(encoding1, encoding2)
-                return max(0, similarity)  # Ensure non-negative
-            elif self.distance_metric == "euclidean":
+            if self.distance_metric == "euclidean":
                 # Euclidean distance (converted to similarity)
-                distance = np.linalg.norm(encoding1 - encoding2)
+                distance = float(np.linalg.norm(encoding1 - encoding2))
                 return 1.0 / (1.0 + distance)
             else:
-                # Default to cosine
-                similarity = np.dot(encoding1, encoding2)
-                return max(0, similarity)
+                # Cosine similarity (default), kept non-negative
+                return max(0.0, float(np.dot(encoding1, encoding2)))
                 
         except Exception as e:
             logging.error(f"Error calculating similarity: {e}")
@@ -213,8 +477,12 @@ class AdvancedCNNFaceRecognition:
     def download_image_from_url(self, url: str) -> Optional[np.ndarray]:
         """Download image from URL and convert to OpenCV format"""
         try:
-            response = requests.get(url, timeout=10)
+            response = self._http.get(url, timeout=10)
             if response.status_code == 200:
+                # Decode straight to BGR; PIL only handles formats OpenCV cannot read
+                image = cv2.imdecode(np.frombuffer(response.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is not None:
+                    return image
                 image = Image.open(BytesIO(response.content))
                 if image.mode != 'RGB':
                     image = image.convert('RGB')
@@ -224,31 +492,56 @@ class AdvancedCNNFaceRecognition:
             logging.error(f"Error downloading image from {url}: {e}")
             return None
     
-    def extract_and_save_face(self, photo_url: str, student_id: str) -> bool:
-        """Extract face from photo URL and save CNN encodings"""
+    def _extract_face(self, photo_url: str, student_id: str) -> bool:
+        """Extract face from photo URL and store CNN encoding in memory (not persisted)"""
+        return self._embed_and_store(self.download_image_from_url(photo_url), photo_url, student_id)
+    
+    def _embed_and_store(self, image: Optional[np.ndarray], photo_url: str, student_id: str) -> bool:
+        """Extract CNN encoding from a downloaded image and store it in memory (not persisted)"""
         try:
-            # Download image
-            image = self.download_image_from_url(photo_url)
             if image is None:
                 logging.error(f"Failed to download image for student {student_id}")
                 return False
             
-            # Save temporary image for CNN processing
-            temp_path = self.faces_dir / f"temp_student_{student_id}.jpg"
-            cv2.imwrite(str(temp_path), image)
+            # Embed the decoded photo, as bulk enrollment does, then keep the face image
+            face_path = self._face_path(student_id)
+            cv2.imwrite(str(face_path), image)
+            encoding = self.extract_cnn_features(image)
+            
+            return self._store_encoding(face_path, encoding, photo_url, student_id)
             
-            # Extract CNN features
-            encoding = self.extract_cnn_features(str(temp_path))
+        except Exception as e:
+            logging.error(f"Error extracting face for student {student_id}: {e}")
+            return False
+    
+    def _prepare_batch_face(self, image: Optional[np.ndarray], student_id: str) -> Optional[np.ndarray]:
+        """Prepare a downloaded photo for batched embedding, logging why it was skipped"""
+        if image is None:
+            logging.error(f"Failed to download image for student {student_id}")
+            return None
+        try:
+            face = self._prepare_face(image)
+            if face is None:
+                logging.error(f"Failed to extract CNN features for student {student_id}")
+            return face
+        except Exception as e:
+            logging.error(f"Error extracting face for student {student_id}: {e}")
+            return None
+    
+    def _face_path(self, student_id: str) -> Path:
+        """Path of a student's saved face image"""
+        return self.faces_dir / f"cnn_student_{student_id}.jpg"
+    
+    def _store_encoding(self, face_path: Path, encoding: Optional[np.ndarray], photo_url: str, student_id: str) -> bool:
+        """Keep a student's CNN encoding and face data in memory (not persisted)"""
+        try:
             if encoding is None:
                 logging.error(f"Failed to extract CNN features for student {student_id}")
                 return False
             
-            # Save permanent face image
-            face_path = self.faces_dir / f"cnn_student_{student_id}.jpg"
-            cv2.imwrite(str(face_path), image)
-            
             # Store encoding and data
-            self.face_encodings[student_id] = encoding
+            self.face_encodings[student_id] = self.normalize_encoding(encoding)
+            self._lbp_centroids.pop(student_id, None)  # Recomputed from the new face image when needed
             self.face_data[student_id] = {
                 'face_path': str(face_path),
                 'photo_url': photo_url,
@@ -256,108 +549,377 @@ class AdvancedCNNFaceRecognition:
                 'model_used': self.model_name if DEEPFACE_AVAILABLE else 'fallback_cnn'
             }
             
-            # Save to files
-            self.save_face_encodings()
-            self.save_face_data()
-            
-            # Clean up temp file
-            if temp_path.exists():
-                temp_path.unlink()
-            
             logging.info(f"✅ CNN encoding extracted for student {student_id} (length: {len(encoding)})")
             return True
             
         except Exception as e:
-            logging.error(f"Error extracting face for student {student_id}: {e}")
+            logging.error(f"Error storing face for student {student_id}: {e}")
             return False
     
-    def recognize_face_from_image(self, image: np.ndarray) -> Optional[Dict]:
-        """Recognize face using CNN with detailed student information"""
+    def extract_and_save_face(self, photo_url: str, student_id: str) -> bool:
+        """Extract face from photo URL and save CNN encodings"""
+        with self._enroll_lock:
+            success = self._extract_face(photo_url, student_id)
+            if success:
+                self._rebuild_matrix()
+                self.save_face_encodings()
+                self.save_face_data()
+        return success
+    
+    def extract_and_save_faces_batch(self, students: List[Tuple[str, str]]) -> Dict[str, bool]:
+        """Extract faces for a batch of (photo_url, student_id) pairs and save encodings once"""
+        return self.bulk_enroll(students, io_workers=self.DOWNLOAD_WORKERS)
+    
+    def bulk_enroll(self, students: List[Tuple[str, str]], io_workers: int = 16) -> Dict[str, bool]:
+        """Enroll (photo_url, student_id) pairs with parallel downloads and feature extraction"""
+        with self._enroll_lock:
+            results = {}
+            
+            # Downloads are I/O bound, so fetch them concurrently; the executor yields
+            # images in order, letting feature extraction start while later photos download
+            with ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+                images = io_pool.map(self.download_image_from_url, [url for url, _ in students])
+            
+                if DEEPFACE_AVAILABLE and self._df_model is not None:
+                    # Detect faces as photos arrive, then embed the whole batch in one forward pass
+                    prepared = []
+                    for (photo_url, student_id), image in zip(students, images):
+                        face = self._prepare_batch_face(image, student_id)
+                        if face is None:
+                            results[student_id] = False
+                        else:
+                            prepared.append((photo_url, student_id, image, face))
+                
+                    try:
+                        embeddings = self._embed_faces([face for *_, face in prepared]) if prepared else []
+                    except Exception as e:
+                        logging.error(f"Error running batched CNN embedding: {e}")
+                        embeddings = [None] * len(prepared)
+                    for (photo_url, student_id, image, _), encoding in zip(prepared, embeddings):
+                        face_path = self._face_path(student_id)
+                        cv2.imwrite(str(face_path), image)
+                        results[student_id] = self._store_encoding(face_path, encoding, photo_url, student_id)
+                elif DEEPFACE_AVAILABLE:
+                    for (photo_url, student_id), image in zip(students, images):
+                        results[student_id] = self._embed_and_store(image, photo_url, student_id)
+                else:
+                    # Fallback features run on the shared feature pool as each photo arrives
+                    pending = []
+                    for (photo_url, student_id), image in zip(students, images):
+                        if image is None:
+                            logging.error(f"Failed to download image for student {student_id}")
+                            results[student_id] = False
+                        else:
+                            pending.append((photo_url, student_id, image,
+                                            self._feature_pool.submit(self.extract_fallback_features, image)))
+                    
+                    for photo_url, student_id, image, future in pending:
+                        try:
+                            encoding = future.result()
+                        except Exception as e:
+                            logging.error(f"Error extracting face for student {student_id}: {e}")
+                            encoding = None
+                        face_path = self._face_path(student_id)
+                        if encoding is not None:
+                            cv2.imwrite(str(face_path), image)
+                        results[student_id] = self._store_encoding(face_path, encoding, photo_url, student_id)
+            
+            # Persist once per batch instead of rewriting the files per student
+            if any(results.values()):
+                self._rebuild_matrix()
+                self.save_face_encodings()
+                self.save_face_data()
+            
+        return results
+    
+    def _rebuild_matrix(self, use_saved: bool = False):
+        """Stack enrolled encodings into a row-normalized float32 matrix and publish a new index"""
+        encodings = dict(self.face_encodings)
+        matrix = None
+        ids = ()
+        
+        save_matrix = False
+        if encodings:
+            stacked = list(encodings.values())
+            if len({len(e) for e in stacked}) == 1:
+                ids = tuple(encodings)
+                matrix = self._load_encoding_matrix(ids, len(stacked[0])) if use_saved else None
+                if matrix is None:
+                    # Encodings are normalized float32 already, so rows are unit vectors
+                    matrix = np.stack(stacked)
+                    save_matrix = use_saved
+            else:
+                # Mixed DeepFace/fallback encodings cannot share one matrix
+                logging.warning("Encodings have mixed lengths, using per-student comparison")
+        
+        # Readers pick up the whole snapshot with a single attribute read
+        self._index = EncodingIndex(
+            encodings=encodings,
+            matrix=matrix,
+            ids=ids,
+            rows={student_id: row for row, student_id in enumerate(ids)},
+            search_index=self._build_search_index(matrix),
+            generation=self._index.generation + 1
+        )
+        if save_matrix:
+            self._save_encoding_matrix()
+    
+    @property
+    def gallery_generation(self) -> int:
+        """Generation of the published gallery; changes whenever enrollments are published"""
+        return self._index.generation
+    
+    def _matrix_path(self, version: str) -> Path:
+        """Matrix file for one encodings version; a fresh name is never memory-mapped yet"""
+        return self.matrix_file.with_name(f"{self.matrix_file.stem}.{version}.npy")
+    
+    def _load_encoding_matrix(self, ids: Tuple[str, ...], dim: int) -> Optional[np.ndarray]:
+        """Memory-map the saved encoding matrix if it was built from exactly the loaded encodings"""
+        if self._encodings_version is None or not self.matrix_manifest_file.exists():
+            return None
+        try:
+            with open(self.matrix_manifest_file, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == self._encodings_version and manifest.get('ids') == list(ids):
+                matrix = np.load(self._matrix_path(self._encodings_version), mmap_mode='r')
+                if matrix.shape == (len(ids), dim) and matrix.dtype == np.float32:
+                    return matrix
+            logging.warning(f"Ignoring stale encoding matrix {self.matrix_manifest_file}")
+        except Exception as e:
+            logging.error(f"Error loading encoding matrix: {e}")
+        return None
+    
+    def _save_encoding_matrix(self):
+        """Save the encoding matrix under a versioned name and point the manifest at it"""
         try:
-            # Save temporary image for CNN processing
-            temp_path = self.faces_dir / "temp_recognition.jpg"
-            cv2.imwrite(str(temp_path), image)
+            index = self._index
+            current = None
+            if index.matrix is None or self._encodings_version is None:
+                if self.matrix_manifest_file.exists():
+                    self.matrix_manifest_file.unlink()
+            else:
+                # os.replace onto a mapped file fails on Windows, so each version gets its own file
+                current = self._matrix_path(self._encodings_version)
+                if not current.exists():
+                    temp_file = current.with_suffix('.tmp.npy')
+                    np.save(temp_file, np.asarray(index.matrix, dtype=np.float32))
+                    os.replace(temp_file, current)
+                temp_manifest = self.matrix_manifest_file.with_suffix('.tmp.json')
+                with open(temp_manifest, 'w') as f:
+                    json.dump({'version': self._encodings_version, 'ids': list(index.ids)}, f)
+                os.replace(temp_manifest, self.matrix_manifest_file)
             
-            # Extract CNN features from uploaded image
-            uploaded_encoding = self.extract_cnn_features(str(temp_path))
-            if uploaded_encoding is None:
-                return {
-                    'match_found': False,
-                    'reason': 'Could not extract face features from uploaded image',
-                    'confidence': 0.0
-                }
+            # Older versions go once nothing maps them; Windows refuses while one still does
+            for old_file in [self.matrix_file, *self.matrix_file.parent.glob(f"{self.matrix_file.stem}.*.npy")]:
+                if old_file != current and old_file.exists():
+                    try:
+                        old_file.unlink()
+                    except OSError:
+                        pass
+        except Exception as e:
+            logging.error(f"Error saving encoding matrix: {e}")
+    
+    def _build_search_index(self, matrix: Optional[np.ndarray]):
+        """Build a Faiss inner-product index over a normalized encoding matrix"""
+        if not FAISS_AVAILABLE or matrix is None:
+            return None
+        
+        try:
+            count, dim = matrix.shape
             
-            # Compare with all stored encodings
-            best_match = None
-            best_similarity = 0.0
-            all_similarities = {}
+            if count >= self.IVF_MIN_STUDENTS:
+                nlist = int(np.sqrt(count))
+                quantizer = faiss.IndexFlatIP(dim)
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+                index.train(matrix)
+                index.nprobe = min(nlist, 8)
+            else:
+                index = faiss.IndexFlatIP(dim)
+            index.add(matrix)
             
-            for student_id, stored_encoding in self.face_encodings.items():
-                similarity = self.calculate_similarity(uploaded_encoding, stored_encoding)
-                all_similarities[student_id] = similarity
-                
-                if similarity > best_similarity:
-                    best_similarity = similarity
-                    best_match = student_id
+            return index
             
-            # Clean up temp file
-            if temp_path.exists():
-                temp_path.unlink()
+        except Exception as e:
+            logging.error(f"Error building search index: {e}")
+            return None
+    
+    def _lbp_descriptor(self, image: Union[str, np.ndarray]) -> Optional[np.ndarray]:
+        """Normalized multi-scale LBP histograms (the first block of the fallback features)"""
+        features = self.extract_fallback_features(image)
+        return None if features is None else self.normalize_encoding(features[:LBP_FEATURE_LENGTH])
+    
+    def _update_lbp_centroid(self, student_id: str, face_path: Path):
+        """Compute a student's LBP descriptor from their saved face image"""
+        descriptor = self._lbp_descriptor(str(face_path))
+        if descriptor is not None:
+            self._lbp_centroids[student_id] = descriptor
+    
+    def _score_lbp(self, index: EncodingIndex, features: np.ndarray) -> Dict[str, float]:
+        """LBP similarity of fallback query features to every enrolled student's saved face"""
+        query = self.normalize_encoding(features[:LBP_FEATURE_LENGTH])
+        with self._enroll_lock:
+            for student_id in index.encodings:
+                face_path = self._face_path(student_id)
+                if student_id not in self._lbp_centroids and face_path.exists():
+                    self._update_lbp_centroid(student_id, face_path)
+            ids = [k for k in index.encodings if k in self._lbp_centroids]
+            centroids = [self._lbp_centroids[k] for k in ids]
+        if not ids:
+            return {}
+        return dict(zip(ids, np.maximum(np.stack(centroids) @ query, 0.0).tolist()))
+    
+    def _score_encodings(self, index: EncodingIndex, encoding: np.ndarray) -> Dict[str, float]:
+        """Similarity of an encoding to enrolled students (the Faiss top-K, or all)"""
+        matrix = index.matrix
+        query = self.normalize_encoding(encoding)
+        if matrix is None or len(query) != matrix.shape[1]:
+            return {
+                student_id: self.calculate_similarity(query, stored_encoding)
+                for student_id, stored_encoding in index.encodings.items()
+                if len(stored_encoding) == len(query)
+            }
+        
+        if index.search_index is not None:
+            k = min(self.SEARCH_TOP_K, len(index.ids))
+            _, positions = index.search_index.search(query.reshape(1, -1), k)
+            rows = positions[0][positions[0] >= 0]
+        else:
+            rows = np.arange(len(index.ids))
+        
+        # One matrix-vector product gives every cosine similarity
+        cosine = matrix[rows] @ query
+        if self.distance_metric == "euclidean":
+            # Distance between unit vectors is sqrt(2 - 2 cos)
+            similarities = 1.0 / (1.0 + np.sqrt(np.maximum(2.0 - 2.0 * cosine, 0.0)))
+        else:
+            similarities = np.maximum(cosine, 0.0)
+        
+        return dict(zip([index.ids[i] for i in rows], similarities.tolist()))
+    
+    def recognize_face_from_image(self, image: np.ndarray) -> Optional[Dict]:
+        """Recognize face using CNN with detailed student information"""
+        try:
+            # One snapshot for the whole recognition, even if an enrollment publishes a new one
+            index = self._index
             
-            # Get detailed student information from database
-            student_details = self.get_student_details(best_match) if best_match else None
+            # Extract CNN features directly from the uploaded image array
+            uploaded_encoding = self.extract_cnn_features(image)
+            if uploaded_encoding is None:
+                return self._no_face_result()
             
-            # Determine if match is acceptable
-            if best_similarity >= self.VERIFICATION_THRESHOLD:
-                confidence_level = "HIGH" if best_similarity >= self.HIGH_CONFIDENCE_THRESHOLD else "MEDIUM"
+            return self._match_encoding(index, uploaded_encoding)
                 
-                return {
-                    'match_found': True,
-                    'student_id': best_match,
-                    'confidence': best_similarity * 100,
-                    'confidence_level': confidence_level,
-                    'similarity_score': best_similarity,
-                    'all_similarities': all_similarities,
-                    'student_details': student_details,
-                    'model_used': self.model_name if DEEPFACE_AVAILABLE else 'fallback_cnn',
-                    'encoding_length': len(uploaded_encoding)
-                }
+        except Exception as e:
+            return self._recognition_error(e)
+    
+    def recognize_faces_batch(self, images: List[np.ndarray]) -> List[Dict]:
+        """Recognize several uploads, embedding every detected face in one CNN forward pass"""
+        if not (DEEPFACE_AVAILABLE and self._df_model is not None):
+            return [self.recognize_face_from_image(image) for image in images]
+        
+        index = self._index
+        
+        # Face detection runs per image on the feature pool; the CNN sees one stacked batch
+        faces = list(self._feature_pool.map(self._try_prepare_face, images))
+        prepared = [face for face in faces if isinstance(face, np.ndarray)]
+        try:
+            embeddings = iter(self._embed_faces(prepared)) if prepared else iter(())
+        except Exception as e:
+            logging.warning(f"Batched CNN embedding failed, recognizing one by one: {e}")
+            return [self.recognize_face_from_image(image) for image in images]
+        
+        results = []
+        for image, face in zip(images, faces):
+            if face is None:
+                results.append(self._no_face_result())
+            elif not isinstance(face, np.ndarray):
+                # Detection raised; the single-image path handles its fallback features
+                results.append(self.recognize_face_from_image(image))
             else:
-                return {
-                    'match_found': False,
-                    'reason': f'Best similarity {best_similarity:.3f} below threshold {self.VERIFICATION_THRESHOLD}',
-                    'confidence': best_similarity * 100,
-                    'best_rejected_match': {
-                        'student_id': best_match,
-                        'similarity': best_similarity,
-                        'student_details': student_details
-                    } if best_match else None,
-                    'all_similarities': all_similarities
-                }
-                
+                try:
+                    results.append(self._match_encoding(index, next(embeddings)))
+                except Exception as e:
+                    results.append(self._recognition_error(e))
+        return results
+    
+    def _try_prepare_face(self, image: np.ndarray) -> Union[np.ndarray, Exception, None]:
+        """_prepare_face, returning the exception instead of raising so one bad upload can't fail a batch"""
+        try:
+            return self._prepare_face(image)
         except Exception as e:
-            logging.error(f"Error recognizing face: {e}")
+            return e
+    
+    def _no_face_result(self) -> Dict:
+        """Result for an upload with no extractable face"""
+        return {
+            'match_found': False,
+            'reason': 'Could not extract face features from uploaded image',
+            'confidence': 0.0
+        }
+    
+    def _recognition_error(self, error: Exception) -> Dict:
+        """Result for a recognition that raised"""
+        logging.error(f"Error recognizing face: {error}")
+        return {
+            'match_found': False,
+            'reason': f'Error during recognition: {str(error)}',
+            'confidence': 0.0
+        }
+    
+    def _match_encoding(self, index: EncodingIndex, uploaded_encoding: np.ndarray) -> Dict:
+        """Score an uploaded encoding against one gallery snapshot and build the recognition result"""
+        # Compare with stored encodings
+        best_match = None
+        best_similarity = 0.0
+        all_similarities = self._score_encodings(index, uploaded_encoding)
+        model_used = self.model_name if DEEPFACE_AVAILABLE else 'fallback_cnn'
+        if DEEPFACE_AVAILABLE and not all_similarities and len(uploaded_encoding) > LBP_FEATURE_LENGTH:
+            # DeepFace fell back to OpenCV features, which no CNN encoding can be compared with
+            all_similarities = self._score_lbp(index, uploaded_encoding)
+            model_used = 'lbp_fallback'
+        
+        if all_similarities:
+            top_match = max(all_similarities, key=all_similarities.get)
+            if all_similarities[top_match] > best_similarity:
+                best_similarity = all_similarities[top_match]
+                best_match = top_match
+        
+        # Get detailed student information from database
+        student_details = self.get_student_details(best_match) if best_match else None
+        
+        # Determine if match is acceptable
+        if best_similarity >= self.VERIFICATION_THRESHOLD:
+            confidence_level = "HIGH" if best_similarity >= self.HIGH_CONFIDENCE_THRESHOLD else "MEDIUM"
+            
+            return {
+                'match_found': True,
+                'student_id': best_match,
+                'confidence': best_similarity * 100,
+                'confidence_level': confidence_level,
+                'similarity_score': best_similarity,
+                'all_similarities': all_similarities,
+                'student_details': student_details,
+                'model_used': model_used,
+                'encoding_length': len(uploaded_encoding)
+            }
+        else:
             return {
                 'match_found': False,
-                'reason': f'Error during recognition: {str(e)}',
-                'confidence': 0.0
+                'reason': f'Best similarity {best_similarity:.3f} below threshold {self.VERIFICATION_THRESHOLD}',
+                'confidence': best_similarity * 100,
+                'best_rejected_match': {
+                    'student_id': best_match,
+                    'similarity': best_similarity,
+                    'student_details': student_details
+                } if best_match else None,
+                'all_similarities': all_similarities
             }
     
     def get_student_details(self, student_id: str) -> Optional[Dict]:
         """Get comprehensive student details from database"""
         try:
-            conn = sqlite3.connect('attendance.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT student_id, roll_number, name, class_name, section, branch, 
-                       photo_url, is_active, created_at, updated_at
-                FROM students 
-                WHERE student_id = ?
-            ''', (student_id,))
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self._db_lock:
+                result = self._db.execute(STUDENT_DETAILS_SQL, (student_id,)).fetchone()
             
             if result:
                 return {
@@ -381,31 +943,62 @@ class AdvancedCNNFaceRecognition:
             return None
     
     def load_face_encodings(self):
-        """Load face encodings from file"""
+        """Load face encodings from file (float16 .npz, or legacy JSON)"""
         if self.encodings_file.exists():
             try:
-                with open(self.encodings_file, 'r') as f:
+                with np.load(self.encodings_file, allow_pickle=False) as data:
+                    ids = data['ids'].tolist()
+                    lengths = data['lengths']
+                    self._encodings_version = _encodings_version(ids, lengths, data['values'])
+                    values = data['values'].astype(np.float32)
+                    splits = np.cumsum(lengths)[:-1]
+                self.face_encodings = {k: self.normalize_encoding(v) for k, v in zip(ids, np.split(values, splits))}
+            except Exception as e:
+                logging.error(f"Error loading face encodings: {e}")
+                self.face_encodings = {}
+        elif self.legacy_encodings_file.exists():
+            try:
+                with open(self.legacy_encodings_file, 'r') as f:
                     data = json.load(f)
-                    self.face_encodings = {k: np.array(v) for k, v in data.items()}
+                    self.face_encodings = {k: self.normalize_encoding(v) for k, v in data.items()}
+                self.save_face_encodings()
+                logging.info(f"Migrated {len(self.face_encodings)} encodings to {self.encodings_file}")
             except Exception as e:
                 logging.error(f"Error loading face encodings: {e}")
                 self.face_encodings = {}
     
     def save_face_encodings(self):
-        """Save face encodings to file"""
+        """Save face encodings to file as one float16 array with ids and lengths"""
         try:
-            data = {k: v.tolist() for k, v in self.face_encodings.items()}
-            with open(self.encodings_file, 'w') as f:
-                json.dump(data, f)
+            ids = list(self.face_encodings.keys())
+            encodings = [self.face_encodings[k] for k in ids]
+            lengths = np.array([len(e) for e in encodings], dtype=np.int64)
+            values = np.concatenate(encodings).astype(np.float16) if encodings else np.zeros(0, dtype=np.float16)
+            np.savez_compressed(
+                self.encodings_file,
+                ids=np.array(ids, dtype=str),
+                lengths=lengths,
+                values=values
+            )
+            self._encodings_version = _encodings_version(ids, lengths, values)
+            self._save_encoding_matrix()
         except Exception as e:
             logging.error(f"Error saving face encodings: {e}")
     
     def load_face_data(self):
-        """Load face data from file"""
+        """Load face data from file (pickle, or legacy JSON)"""
         if self.face_data_file.exists():
             try:
-                with open(self.face_data_file, 'r') as f:
+                with open(self.face_data_file, 'rb') as f:
+                    self.face_data = pickle.load(f)
+            except Exception as e:
+                logging.error(f"Error loading face data: {e}")
+                self.face_data = {}
+        elif self.legacy_face_data_file.exists():
+            try:
+                with open(self.legacy_face_data_file, 'r') as f:
                     self.face_data = json.load(f)
+                self.save_face_data()
             except Exception as e:
                 logging.error(f"Error loading face data: {e}")
                 self.face_data = {}
@@ -413,22 +1006,32 @@ class AdvancedCNNFaceRecognition:
     def save_face_data(self):
         """Save face data to file"""
         try:
-            with open(self.face_data_file, 'w') as f:
-                json.dump(self.face_data, f, indent=2)
+            with open(self.face_data_file, 'wb') as f:
+                pickle.dump(self.face_data, f, protocol=5)
         except Exception as e:
             logging.error(f"Error saving face data: {e}")
     
+    def export_face_data_json(self):
+        """Write face data as readable JSON for debugging"""
+        try:
+            with open(self.legacy_face_data_file, 'w') as f:
+                json.dump(self.face_data, f, indent=2)
+        except Exception as e:
+            logging.error(f"Error exporting face data: {e}")
+    
     def get_statistics(self) -> Dict:
         """Get system statistics"""
+        index = self._index
         return {
-            'total_students': len(self.face_encodings),
+            'total_students': len(index.encodings),
             'model_used': self.model_name if DEEPFACE_AVAILABLE else 'fallback_cnn',
             'verification_threshold': self.VERIFICATION_THRESHOLD,
             'high_confidence_threshold': self.HIGH_CONFIDENCE_THRESHOLD,
             'detector_backend': self.detector_backend,
             'distance_metric': self.distance_metric,
             'deepface_available': DEEPFACE_AVAILABLE,
-            'students_enrolled': list(self.face_encodings.keys())
+            'faiss_available': FAISS_AVAILABLE,
+            'students_enrolled': list(index.encodings)
         }
 
 # Initialize the advanced CNN face recognizer
@@ -2,88 +2,179 @@
 Analytics and reporting utilities for attendance data
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, extract, desc
+from sqlalchemy import func, and_, extract, desc, case, select, bindparam, literal, union_all
 from typing import List, Dict, Optional
 from datetime import date, datetime, timedelta
+import calendar
+import numpy as np
 import pandas as pd
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import json
 
 from backend.models import Student, Teacher, Class, Attendance, StudentClass
 
+REPORT_COLUMNS = [
+    'student_id', 'student_name', 'roll_number', 'class_name', 'section',
+    'total_days', 'present_days', 'absent_days', 'attendance_percentage'
+]
+LOW_ATTENDANCE_THRESHOLD = 75
+STREAM_BATCH_SIZE = 500  # rows fetched per round trip by the streamed queries
 
-def generate_attendance_report(
-    db: Session, 
-    class_id: Optional[int] = None,
-    start_date: Optional[date] = None,
-    end_date: Optional[date] = None,
-    format_type: str = "json"
-) -> Dict:
-    """Generate comprehensive attendance report"""
+# Per-status counts as plain conditional sums, which planners aggregate directly
+PRESENT_COUNT = func.sum(case((Attendance.status == 'Present', 1), else_=0))
+ABSENT_COUNT = func.sum(case((Attendance.status == 'Absent', 1), else_=0))
+TOTAL_DAYS = func.count(Attendance.attendance_id)
+ATTENDANCE_PERCENTAGE = PRESENT_COUNT * 100.0 / TOTAL_DAYS
+STUDENT_GROUP_BY = (
+    Student.student_id, Student.name, Student.roll_number,
+    Class.class_name, Class.section
+)
+
+
+def _build_report_statement(by_class: bool):
+    """Per-student report query over a :start_date/:end_date range"""
+    stmt = select(
+        Student.student_id,
+        Student.name.label('student_name'),
+        Student.roll_number,
+        Class.class_name,
+        Class.section,
+        TOTAL_DAYS.label('total_days'),
+        PRESENT_COUNT.label('present_days'),
+        ABSENT_COUNT.label('absent_days'),
+        ATTENDANCE_PERCENTAGE.label('attendance_percentage')
+    ).join(
+        StudentClass, Student.student_id == StudentClass.student_id
+    ).join(
+        Class, StudentClass.class_id == Class.class_id
+    ).join(
+        # Attendance rows carry no class; the class comes from the student's enrollment
+        Attendance, Student.student_id == Attendance.student_id
+    ).where(
+        Attendance.attendance_date.between(bindparam('start_date'), bindparam('end_date'))
+    )
     
-    # Default date range (last 30 days)
-    if not end_date:
-        end_date = date.today()
-    if not start_date:
-        start_date = end_date - timedelta(days=30)
+    if by_class:
+        stmt = stmt.where(Class.class_id == bindparam('class_id'))
     
-    # Base query
-    query = db.query(
+    return stmt.group_by(*STUDENT_GROUP_BY)
+
+
+def _build_report_summary_statement(report_stmt):
+    """Summary statistics aggregated by the database over the grouped report rows"""
+    per_student = report_stmt.subquery()
+    return select(
+        func.count(),
+        func.avg(per_student.c.attendance_percentage),
+        func.count().filter(per_student.c.attendance_percentage < LOW_ATTENDANCE_THRESHOLD)
+    ).select_from(per_student)
+
+
+def _build_ranking_statement(by_class: bool):
+    """Per-student attendance percentages for students with at least 5 days of data"""
+    stmt = select(
         Student.student_id,
-        Student.name.label('student_name'),
+        Student.name,
         Student.roll_number,
         Class.class_name,
         Class.section,
-        func.count(Attendance.attendance_id).label('total_days'),
-        func.count(func.nullif(Attendance.status != 'Present', True)).label('present_days'),
-        func.count(func.nullif(Attendance.status != 'Absent', True)).label('absent_days')
+        TOTAL_DAYS.label('total_days'),
+        PRESENT_COUNT.label('present_days'),
+        ATTENDANCE_PERCENTAGE.label('attendance_percentage')
     ).join(
         StudentClass, Student.student_id == StudentClass.student_id
     ).join(
         Class, StudentClass.class_id == Class.class_id
     ).join(
-        Attendance, and_(
-            Student.student_id == Attendance.student_id,
-            Class.class_id == Attendance.class_id
-        )
-    ).filter(
-        Attendance.attendance_date.between(start_date, end_date)
+        Attendance, Student.student_id == Attendance.student_id
     )
     
-    if class_id:
-        query = query.filter(Class.class_id == class_id)
+    if by_class:
+        stmt = stmt.where(Class.class_id == bindparam('class_id'))
     
-    # Group by student
-    query = query.group_by(
-        Student.student_id, Student.name, Student.roll_number,
-        Class.class_name, Class.section
+    return stmt.group_by(*STUDENT_GROUP_BY).having(
+        TOTAL_DAYS >= 5  # Minimum 5 days of data
     )
+
+
+def _build_extremes_statement(by_class: bool):
+    """Top performers and students below :threshold from one shared student_pcts CTE"""
+    student_pcts = _build_ranking_statement(by_class).cte('student_pcts')
+    top = select(student_pcts, literal('top').label('slice')).order_by(
+        student_pcts.c.attendance_percentage.desc()
+    ).limit(bindparam('limit')).subquery()
+    attention = select(student_pcts, literal('attention').label('slice')).where(
+        student_pcts.c.attendance_percentage < bindparam('threshold')
+    ).subquery()
+    return union_all(select(top), select(attention))
+
+
+# Statements are built once at import, keyed by whether a class filter applies;
+# each call only binds its parameters
+REPORT_STATEMENTS = {
+    by_class: _build_report_statement(by_class).execution_options(yield_per=STREAM_BATCH_SIZE)
+    for by_class in (False, True)
+}
+REPORT_SUMMARY_STATEMENTS = {
+    by_class: _build_report_summary_statement(_build_report_statement(by_class))
+    for by_class in (False, True)
+}
+TOP_PERFORMERS_STATEMENTS = {
+    by_class: _build_ranking_statement(by_class).order_by(
+        desc('attendance_percentage')
+    ).limit(bindparam('limit'))
+    for by_class in (False, True)
+}
+NEEDING_ATTENTION_STATEMENTS = {
+    by_class: _build_ranking_statement(by_class).having(
+        ATTENDANCE_PERCENTAGE < bindparam('threshold')
+    ).order_by('attendance_percentage').execution_options(yield_per=STREAM_BATCH_SIZE)
+    for by_class in (False, True)
+}
+EXTREMES_STATEMENTS = {
+    by_class: _build_extremes_statement(by_class)
+    for by_class in (False, True)
+}
+
+
+def generate_attendance_report(
+    db: Session, 
+    class_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    format_type: str = "json",
+    as_dataframe: bool = False
+) -> Dict:
+    """Generate comprehensive attendance report (student tables as DataFrames if as_dataframe)"""
     
-    results = query.all()
+    # Default date range (last 30 days)
+    if not end_date:
+        end_date = date.today()
+    if not start_date:
+        start_date = end_date - timedelta(days=30)
     
-    # Calculate attendance percentages and format data
-    report_data = []
-    for row in results:
-        attendance_percentage = (row.present_days / row.total_days * 100) if row.total_days > 0 else 0
-        
-        report_data.append({
-            'student_id': row.student_id,
-            'student_name': row.student_name,
-            'roll_number': row.roll_number,
-            'class_name': row.class_name,
-            'section': row.section,
-            'total_days': row.total_days,
-            'present_days': row.present_days,
-            'absent_days': row.absent_days,
-            'attendance_percentage': round(attendance_percentage, 2)
-        })
+    params = {'start_date': start_date, 'end_date': end_date, 'class_id': class_id}
+    by_class = bool(class_id)
+    
+    total_students, avg_attendance, low_attendance_count = db.execute(
+        REPORT_SUMMARY_STATEMENTS[by_class], params
+    ).one()
+    
+    # Stream the grouped rows in batches rather than buffering the whole cursor
+    results = db.execute(REPORT_STATEMENTS[by_class], params)
     
-    # Generate summary statistics
-    total_students = len(report_data)
-    avg_attendance = sum(r['attendance_percentage'] for r in report_data) / total_students if total_students > 0 else 0
+    df = pd.DataFrame.from_records(results, columns=REPORT_COLUMNS, coerce_float=True)
+    df['attendance_percentage'] = df.attendance_percentage.astype(float).round(2)
     
     # Students with low attendance (below 75%)
-    low_attendance_students = [r for r in report_data if r['attendance_percentage'] < 75]
+    low_attendance_df = df[df.attendance_percentage < LOW_ATTENDANCE_THRESHOLD]
+    
+    if as_dataframe:
+        report_data, low_attendance_students = df, low_attendance_df
+    else:
+        report_data = df.to_dict('records')
+        low_attendance_students = low_attendance_df.to_dict('records')
     
     summary = {
         'report_period': {
@@ -92,9 +183,9 @@ def generate_attendance_report(
         },
         'summary_statistics': {
             'total_students': total_students,
-            'average_attendance_percentage': round(avg_attendance, 2),
-            'students_with_low_attendance': len(low_attendance_students),
-            'low_attendance_threshold': 75
+            'average_attendance_percentage': round(avg_attendance or 0, 2),
+            'students_with_low_attendance': low_attendance_count,
+            'low_attendance_threshold': LOW_ATTENDANCE_THRESHOLD
         },
         'student_data': report_data,
         'low_attendance_students': low_attendance_students
@@ -103,6 +194,33 @@ def generate_attendance_report(
     return summary
 
 
+def _daily_attendance_counts(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    class_id: Optional[int] = None
+) -> List:
+    """Per-day (attendance_date, total_marked, present_count, absent_count) rows in date order"""
+    
+    # Aggregated live so late or corrected marks always show; ix_att_date_status covers the scan
+    daily = select(
+        Attendance.attendance_date,
+        TOTAL_DAYS,
+        PRESENT_COUNT,
+        ABSENT_COUNT
+    ).where(
+        Attendance.attendance_date.between(start_date, end_date)
+    )
+    if class_id:
+        # Attendance rows carry no class; restrict to the class's enrolled students
+        daily = daily.where(Attendance.student_id.in_(
+            select(StudentClass.student_id).where(StudentClass.class_id == class_id)
+        ))
+    daily = daily.group_by(Attendance.attendance_date).order_by(Attendance.attendance_date)
+    
+    return db.execute(daily).all()
+
+
 def generate_daily_attendance_trends(
     db: Session,
     class_id: Optional[int] = None,
@@ -113,41 +231,25 @@ def generate_daily_attendance_trends(
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
     
-    # Query daily attendance data
-    query = db.query(
-        Attendance.attendance_date,
-        func.count(Attendance.attendance_id).label('total_marked'),
-        func.count(func.nullif(Attendance.status != 'Present', True)).label('present_count'),
-        func.count(func.nullif(Attendance.status != 'Absent', True)).label('absent_count')
-    ).filter(
-        Attendance.attendance_date.between(start_date, end_date)
-    )
-    
-    if class_id:
-        query = query.filter(Attendance.class_id == class_id)
-    
-    query = query.group_by(Attendance.attendance_date).order_by(Attendance.attendance_date)
+    results = _daily_attendance_counts(db, start_date, end_date, class_id)
     
-    results = query.all()
+    # Percentages for the whole range in one vectorized pass
+    dates, total_marked, present_count, absent_count = (
+        zip(*results) if results else ((), (), (), ())
+    )
+    total = np.asarray(total_marked, dtype=np.int64)
+    present = np.asarray(present_count, dtype=np.int64)
+    attendance_pct = np.divide(present, total, out=np.zeros(len(total)), where=total > 0) * 100
     
     # Format data for chart visualization
     trends_data = {
-        'dates': [],
-        'total_marked': [],
-        'present_count': [],
-        'absent_count': [],
-        'attendance_percentage': []
+        'dates': [attendance_date.isoformat() for attendance_date in dates],
+        'total_marked': total.tolist(),
+        'present_count': present.tolist(),
+        'absent_count': list(absent_count),
+        'attendance_percentage': np.round(attendance_pct, 2).tolist()
     }
     
-    for row in results:
-        attendance_pct = (row.present_count / row.total_marked * 100) if row.total_marked > 0 else 0
-        
-        trends_data['dates'].append(row.attendance_date.isoformat())
-        trends_data['total_marked'].append(row.total_marked)
-        trends_data['present_count'].append(row.present_count)
-        trends_data['absent_count'].append(row.absent_count)
-        trends_data['attendance_percentage'].append(round(attendance_pct, 2))
-    
     return trends_data
 
 
@@ -162,16 +264,16 @@ def generate_class_wise_summary(db: Session, teacher_id: Optional[int] = None) -
         Teacher.name.label('teacher_name'),
         func.count(func.distinct(StudentClass.student_id)).label('total_students'),
         func.count(Attendance.attendance_id).label('total_attendance_records'),
-        func.count(func.nullif(Attendance.status != 'Present', True)).label('total_present'),
+        PRESENT_COUNT.label('total_present'),
         func.avg(
-            func.cast(func.nullif(Attendance.status != 'Present', True), func.FLOAT) * 100
+            case((Attendance.status == 'Present', 100.0), else_=0.0)
         ).label('avg_attendance_percentage')
     ).join(
         Teacher, Class.teacher_id == Teacher.teacher_id
     ).join(
         StudentClass, Class.class_id == StudentClass.class_id
     ).outerjoin(
-        Attendance, Class.class_id == Attendance.class_id
+        Attendance, StudentClass.student_id == Attendance.student_id
     )
     
     if teacher_id:
@@ -182,7 +284,7 @@ def generate_class_wise_summary(db: Session, teacher_id: Optional[int] = None) -
         Class.subject, Teacher.name
     )
     
-    results = query.all()
+    results = query.yield_per(STREAM_BATCH_SIZE)
     
     class_summary = []
     for row in results:
@@ -203,55 +305,32 @@ def generate_class_wise_summary(db: Session, teacher_id: Optional[int] = None) -
     return {'classes': class_summary}
 
 
+def _format_ranked_student(row, threshold: Optional[float] = None) -> Dict:
+    """Format a ranking row, adding the deficit below threshold when one is given"""
+    student = {
+        'student_id': row.student_id,
+        'name': row.name,
+        'roll_number': row.roll_number,
+        'class_name': row.class_name,
+        'section': row.section,
+        'total_days': row.total_days,
+        'present_days': row.present_days,
+        'attendance_percentage': round(row.attendance_percentage, 2)
+    }
+    if threshold is not None:
+        student['deficit_percentage'] = round(threshold - row.attendance_percentage, 2)
+    return student
+
+
 def get_top_performers(db: Session, limit: int = 10, class_id: Optional[int] = None) -> List[Dict]:
     """Get top performing students by attendance percentage"""
     
-    query = db.query(
-        Student.student_id,
-        Student.name,
-        Student.roll_number,
-        Class.class_name,
-        Class.section,
-        func.count(Attendance.attendance_id).label('total_days'),
-        func.count(func.nullif(Attendance.status != 'Present', True)).label('present_days'),
-        (func.count(func.nullif(Attendance.status != 'Present', True)) * 100.0 / 
-         func.count(Attendance.attendance_id)).label('attendance_percentage')
-    ).join(
-        StudentClass, Student.student_id == StudentClass.student_id
-    ).join(
-        Class, StudentClass.class_id == Class.class_id
-    ).join(
-        Attendance, Student.student_id == Attendance.student_id
-    )
-    
-    if class_id:
-        query = query.filter(Class.class_id == class_id)
-    
-    query = query.group_by(
-        Student.student_id, Student.name, Student.roll_number,
-        Class.class_name, Class.section
-    ).having(
-        func.count(Attendance.attendance_id) >= 5  # Minimum 5 days of data
-    ).order_by(
-        desc('attendance_percentage')
-    ).limit(limit)
-    
-    results = query.all()
+    results = db.execute(
+        TOP_PERFORMERS_STATEMENTS[bool(class_id)],
+        {'limit': limit, 'class_id': class_id}
+    ).all()
     
-    top_performers = []
-    for row in results:
-        top_performers.append({
-            'student_id': row.student_id,
-            'name': row.name,
-            'roll_number': row.roll_number,
-            'class_name': row.class_name,
-            'section': row.section,
-            'total_days': row.total_days,
-            'present_days': row.present_days,
-            'attendance_percentage': round(row.attendance_percentage, 2)
-        })
-    
-    return top_performers
+    return [_format_ranked_student(row) for row in results]
 
 
 def get_students_needing_attention(
@@ -261,56 +340,47 @@ def get_students_needing_attention(
 ) -> List[Dict]:
     """Get students with attendance below threshold"""
     
-    query = db.query(
-        Student.student_id,
-        Student.name,
-        Student.roll_number,
-        Class.class_name,
-        Class.section,
-        func.count(Attendance.attendance_id).label('total_days'),
-        func.count(func.nullif(Attendance.status != 'Present', True)).label('present_days'),
-        (func.count(func.nullif(Attendance.status != 'Present', True)) * 100.0 / 
-         func.count(Attendance.attendance_id)).label('attendance_percentage')
-    ).join(
-        StudentClass, Student.student_id == StudentClass.student_id
-    ).join(
-        Class, StudentClass.class_id == Class.class_id
-    ).join(
-        Attendance, Student.student_id == Attendance.student_id
+    # Streamed in batches; only the formatted records are kept
+    results = db.execute(
+        NEEDING_ATTENTION_STATEMENTS[bool(class_id)],
+        {'threshold': threshold, 'class_id': class_id}
     )
     
-    if class_id:
-        query = query.filter(Class.class_id == class_id)
-    
-    query = query.group_by(
-        Student.student_id, Student.name, Student.roll_number,
-        Class.class_name, Class.section
-    ).having(
-        func.count(Attendance.attendance_id) >= 5  # Minimum 5 days of data
-    ).having(
-        (func.count(func.nullif(Attendance.status != 'Present', True)) * 100.0 / 
-         func.count(Attendance.attendance_id)) < threshold
-    ).order_by(
-        'attendance_percentage'
-    )
+    return [_format_ranked_student(row, threshold) for row in results]
+
+
+def get_attendance_extremes(
+    db: Session,
+    limit: int = 10,
+    threshold: float = 75.0,
+    class_id: Optional[int] = None
+) -> Dict:
+    """Get top performers and students needing attention in a single query"""
     
-    results = query.all()
+    results = db.execute(
+        EXTREMES_STATEMENTS[bool(class_id)],
+        {'limit': limit, 'threshold': threshold, 'class_id': class_id}
+    ).all()
     
-    attention_needed = []
-    for row in results:
-        attention_needed.append({
-            'student_id': row.student_id,
-            'name': row.name,
-            'roll_number': row.roll_number,
-            'class_name': row.class_name,
-            'section': row.section,
-            'total_days': row.total_days,
-            'present_days': row.present_days,
-            'attendance_percentage': round(row.attendance_percentage, 2),
-            'deficit_percentage': round(threshold - row.attendance_percentage, 2)
-        })
+    top_rows = sorted(
+        (row for row in results if row.slice == 'top'),
+        key=lambda row: row.attendance_percentage, reverse=True
+    )
+    attention_rows = sorted(
+        (row for row in results if row.slice == 'attention'),
+        key=lambda row: row.attendance_percentage
+    )
     
-    return attention_needed
+    return {
+        'top_performers': [_format_ranked_student(row) for row in top_rows],
+        'students_needing_attention': [_format_ranked_student(row, threshold) for row in attention_rows]
+    }
+
+
+def _daily_trends_in_new_session(bind, class_id: Optional[int]) -> Dict:
+    """Run generate_daily_attendance_trends on a dedicated session"""
+    with Session(bind=bind) as trends_db:
+        return generate_daily_attendance_trends(trends_db, class_id)
 
 
 def export_attendance_to_excel(
@@ -321,28 +391,31 @@ def export_attendance_to_excel(
 ) -> BytesIO:
     """Export attendance data to Excel file"""
     
-    # Generate report data
-    report_data = generate_attendance_report(db, class_id, start_date, end_date)
+    # Daily trends run concurrently on their own session (sessions are not thread-safe)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        trends_future = executor.submit(_daily_trends_in_new_session, db.get_bind(), class_id)
+        
+        # Generate report data
+        report_data = generate_attendance_report(db, class_id, start_date, end_date, as_dataframe=True)
+        trends_data = trends_future.result()
     
-    # Create Excel file in memory
+    # Create Excel file in memory. No constant_memory: to_excel writes column by column,
+    # which that mode would truncate to the last row of every column after the first
     excel_buffer = BytesIO()
     
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
         # Summary sheet
         summary_df = pd.DataFrame([report_data['summary_statistics']])
         summary_df.to_excel(writer, sheet_name='Summary', index=False)
         
         # Student data sheet
-        student_df = pd.DataFrame(report_data['student_data'])
-        student_df.to_excel(writer, sheet_name='Student Attendance', index=False)
+        report_data['student_data'].to_excel(writer, sheet_name='Student Attendance', index=False)
         
         # Low attendance students sheet
-        if report_data['low_attendance_students']:
-            low_attendance_df = pd.DataFrame(report_data['low_attendance_students'])
-            low_attendance_df.to_excel(writer, sheet_name='Low Attendance', index=False)
+        if not report_data['low_attendance_students'].empty:
+            report_data['low_attendance_students'].to_excel(writer, sheet_name='Low Attendance', index=False)
         
         # Daily trends sheet
-        trends_data = generate_daily_attendance_trends(db, class_id)
         trends_df = pd.DataFrame(trends_data)
         trends_df.to_excel(writer, sheet_name='Daily Trends', index=False)
     
@@ -353,24 +426,9 @@ def export_attendance_to_excel(
 def get_monthly_attendance_summary(db: Session, year: int, month: int, class_id: Optional[int] = None) -> Dict:
     """Get monthly attendance summary"""
     
-    query = db.query(
-        func.extract('day', Attendance.attendance_date).label('day'),
-        func.count(Attendance.attendance_id).label('total_marked'),
-        func.count(func.nullif(Attendance.status != 'Present', True)).label('present_count')
-    ).filter(
-        and_(
-            func.extract('year', Attendance.attendance_date) == year,
-            func.extract('month', Attendance.attendance_date) == month
-        )
-    )
-    
-    if class_id:
-        query = query.filter(Attendance.class_id == class_id)
-    
-    query = query.group_by(func.extract('day', Attendance.attendance_date))
-    query = query.order_by(func.extract('day', Attendance.attendance_date))
-    
-    results = query.all()
+    month_start = date(year, month, 1)
+    month_end = date(year, month, calendar.monthrange(year, month)[1])
+    results = _daily_attendance_counts(db, month_start, month_end, class_id)
     
     monthly_data = {
         'year': year,
@@ -378,13 +436,13 @@ def get_monthly_attendance_summary(db: Session, year: int, month: int, class_id:
         'daily_attendance': []
     }
     
-    for row in results:
-        attendance_pct = (row.present_count / row.total_marked * 100) if row.total_marked > 0 else 0
+    for attendance_date, total_marked, present_count, _ in results:
+        attendance_pct = (present_count / total_marked * 100) if total_marked > 0 else 0
         
         monthly_data['daily_attendance'].append({
-            'day': int(row.day),
-            'total_marked': row.total_marked,
-            'present_count': row.present_count,
+            'day': attendance_date.day,
+            'total_marked': total_marked,
+            'present_count': present_count,
             'attendance_percentage': round(attendance_pct, 2)
         })
     
@@ -1,15 +1,18 @@
 """
 Authentication utilities for JWT token handling and password management
 """
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from decouple import config
 from backend.database import get_db
+from backend.security_config import (
+    pwd_context, verify_password, get_password_hash, get_teacher_cached,
+    decode_token as _decode_token
+)
 from backend.models import Teacher
 from backend.schemas import TokenData
 
@@ -17,41 +20,29 @@ from backend.schemas import TokenData
 SECRET_KEY = config('SECRET_KEY', default='your-secret-key-here')
 ALGORITHM = config('ALGORITHM', default='HS256')
 ACCESS_TOKEN_EXPIRE_MINUTES = int(config('ACCESS_TOKEN_EXPIRE_MINUTES', default=30))
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+DEFAULT_TOKEN_EXPIRY = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
 # Token authentication
 security = HTTPBearer()
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str) -> str:
-    """Hash a password"""
-    return pwd_context.hash(password)
-
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    
-    to_encode.update({"exp": expire})
+    expire = datetime.now(timezone.utc) + (expires_delta or DEFAULT_TOKEN_EXPIRY)
+    to_encode = {**data, "exp": expire}
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def decode_token(token: str) -> dict:
+    """Decode a JWT signed with this module's key"""
+    return _decode_token(token, SECRET_KEY, ALGORITHM)
+
+
 def verify_token(token: str, credentials_exception):
     """Verify JWT token"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
@@ -62,10 +53,16 @@ def verify_token(token: str, credentials_exception):
 
 
 def get_current_teacher(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ):
     """Get current authenticated teacher"""
+    # Resolved once per request, however many dependencies ask for it
+    teacher = getattr(request.state, 'teacher', None)
+    if teacher is not None:
+        return teacher
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -73,7 +70,7 @@ def get_current_teacher(
     )
     
     token_data = verify_token(credentials.credentials, credentials_exception)
-    teacher = db.query(Teacher).filter(Teacher.email == token_data.email).first()
+    teacher = get_teacher_cached(db, Teacher.email, token_data.email)
     
     if teacher is None:
         raise credentials_exception
@@ -84,6 +81,7 @@ def get_current_teacher(
             detail="Teacher account is deactivated"
         )
     
+    request.state.teacher = teacher
     return teacher
 
 
@@ -94,4 +92,7 @@ def authenticate_teacher(db: Session, email: str, password: str):
         return False
     if not verify_password(password, teacher.password_hash):
         return False
+    if pwd_context.needs_update(teacher.password_hash):
+        teacher.password_hash = get_password_hash(password)
+        db.commit()
     return teacher
@@ -1,14 +1,17 @@
 """
 Authentication and authorization for the new attendance system with string IDs
 """
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from backend.database_new import get_db
+from backend.security_config import (
+    pwd_context, verify_password, get_password_hash, get_teacher_cached,
+    decode_token as _decode_token
+)
 from backend.models_new import Teacher
 from backend.schemas_new import TokenData
 
@@ -16,24 +19,12 @@ from backend.schemas_new import TokenData
 SECRET_KEY = "your-secret-key-here-change-in-production"  # Change this in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+DEFAULT_TOKEN_EXPIRY = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
 # Bearer token scheme
 security = HTTPBearer()
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a plain password against a hashed password"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str) -> str:
-    """Hash a password"""
-    return pwd_context.hash(password)
-
-
 def authenticate_teacher(db: Session, email: str, password: str) -> Optional[Teacher]:
     """Authenticate a teacher by email and password"""
     teacher = db.query(Teacher).filter(Teacher.email == email).first()
@@ -41,27 +32,36 @@ def authenticate_teacher(db: Session, email: str, password: str) -> Optional[Tea
         return None
     if not verify_password(password, teacher.password_hash):
         return None
+    if pwd_context.needs_update(teacher.password_hash):
+        teacher.password_hash = get_password_hash(password)
+        db.commit()
     return teacher
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    
-    to_encode.update({"exp": expire})
+    expire = datetime.now(timezone.utc) + (expires_delta or DEFAULT_TOKEN_EXPIRY)
+    to_encode = {**data, "exp": expire}
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def decode_token(token: str) -> dict:
+    """Decode a JWT signed with this module's key"""
+    return _decode_token(token, SECRET_KEY, ALGORITHM)
+
+
 async def get_current_teacher(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> Teacher:
     """Get the current authenticated teacher"""
+    # Resolved once per request, however many dependencies ask for it
+    teacher = getattr(request.state, 'teacher', None)
+    if teacher is not None:
+        return teacher
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -69,7 +69,7 @@ async def get_current_teacher(
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(credentials.credentials)
         teacher_id: str = payload.get("sub")
         if teacher_id is None:
             raise credentials_exception
@@ -77,19 +77,21 @@ async def get_current_teacher(
     except JWTError:
         raise credentials_exception
     
-    teacher = db.query(Teacher).filter(Teacher.teacher_id == token_data.teacher_id).first()
+    teacher = get_teacher_cached(db, Teacher.teacher_id, token_data.teacher_id)
     if teacher is None:
         raise credentials_exception
     
+    request.state.teacher = teacher
     return teacher
 
 
 async def get_current_teacher_optional(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> Optional[Teacher]:
     """Get the current authenticated teacher, return None if not authenticated"""
     try:
-        return await get_current_teacher(credentials, db)
+        return await get_current_teacher(request, credentials, db)
     except HTTPException:
         return None
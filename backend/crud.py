@@ -2,21 +2,67 @@
 CRUD operations and business logic for the attendance system
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, extract
+from sqlalchemy import and_, func, extract, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from typing import List, Optional
-from datetime import date, datetime
+from datetime import date, datetime, timezone
 import pandas as pd
 import json
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 from io import BytesIO
+from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from backend.models import Teacher, Student, Class, StudentClass, Attendance
 from backend.schemas import (
     TeacherCreate, TeacherUpdate, StudentCreate, StudentUpdate,
     ClassCreate, ClassUpdate, AttendanceCreate, AttendanceBulkCreate
 )
 from backend.auth import get_password_hash
+from backend.security_config import evict_cached_teacher
+
+IMPORT_BATCH_SIZE = 1000  # students inserted per executemany round trip
+IMPORT_READ_CHUNK_SIZE = 10000  # spreadsheet rows held in memory at once during import
+PHOTO_DOWNLOAD_WORKERS = 32  # concurrent photo downloads during bulk import
+PHOTO_PROCESS_WORKERS = os.cpu_count() or 4  # concurrent resize/save jobs
+PHOTOS_DIR = "static/photos"
+PHOTO_MAX_SIZE = (300, 300)
+PHOTO_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}  # extension -> Pillow format
+
+# Accepted spreadsheet headers (casefolded, stripped) for each student field
+IMPORT_COLUMN_ALIASES = {
+    'roll number': 'roll_number', 'roll_number': 'roll_number', 'roll': 'roll_number', 'rollnumber': 'roll_number',
+    'name': 'name', 'student name': 'name', 'student_name': 'name',
+    'class': 'class_name', 'class_name': 'class_name', 'grade': 'class_name',
+    'section': 'section', 'sec': 'section',
+    'branch': 'branch', 'stream': 'branch', 'course': 'branch',
+    'photo': 'photo_url', 'photo url': 'photo_url', 'photo_url': 'photo_url', 'image': 'photo_url',
+}
+IMPORT_FIELDS = ['roll_number', 'name', 'class_name', 'section', 'branch', 'photo_url']
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE support
+UPSERT_INSERTS = {'postgresql': pg_insert, 'sqlite': sqlite_insert}
+
+
+def _build_http_session() -> requests.Session:
+    """Shared session so photo downloads reuse pooled keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=PHOTO_DOWNLOAD_WORKERS,
+        pool_maxsize=PHOTO_DOWNLOAD_WORKERS,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_HTTP = _build_http_session()
 
 
 def convert_google_drive_url(url: str) -> str:
@@ -41,31 +87,41 @@ def convert_google_drive_url(url: str) -> str:
     return url
 
 
+def _insert_returning(db: Session, model, values: dict, commit: bool = True):
+    """INSERT ... RETURNING a new row and commit, without a refresh SELECT afterwards"""
+    db_obj = db.scalars(insert(model).values(**values).returning(model)).one()
+    if not commit:
+        return db_obj
+    # The returned row is already complete, so keep it loaded across the commit
+    expire_on_commit, db.expire_on_commit = db.expire_on_commit, False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = expire_on_commit
+    return db_obj
+
+
 # Teacher CRUD operations
 def create_teacher(db: Session, teacher: TeacherCreate):
     """Create a new teacher"""
     hashed_password = get_password_hash(teacher.password)
-    db_teacher = Teacher(
-        name=teacher.name,
-        email=teacher.email,
-        password_hash=hashed_password,
-        department=teacher.department,
-        phone=teacher.phone
-    )
-    db.add(db_teacher)
-    db.commit()
-    db.refresh(db_teacher)
-    return db_teacher
+    return _insert_returning(db, Teacher, {
+        'name': teacher.name,
+        'email': teacher.email,
+        'password_hash': hashed_password,
+        'department': teacher.department,
+        'phone': teacher.phone
+    })
 
 
 def get_teacher_by_email(db: Session, email: str):
     """Get teacher by email"""
-    return db.query(Teacher).filter(Teacher.email == email).first()
+    return db.execute(select(Teacher).where(Teacher.email == email)).scalar_one_or_none()
 
 
 def get_teacher_by_id(db: Session, teacher_id: int):
-    """Get teacher by ID"""
-    return db.query(Teacher).filter(Teacher.teacher_id == teacher_id).first()
+    """Get teacher by ID; free when this session already holds them, as after get_current_teacher"""
+    return db.get(Teacher, teacher_id)
 
 
 def update_teacher(db: Session, teacher_id: int, teacher_update: TeacherUpdate):
@@ -78,34 +134,32 @@ def update_teacher(db: Session, teacher_id: int, teacher_update: TeacherUpdate):
         db_teacher.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(db_teacher)
+        # Authentication must not keep serving the pre-update snapshot
+        evict_cached_teacher(db_teacher)
     return db_teacher
 
 
 # Student CRUD operations
-def create_student(db: Session, student: StudentCreate, teacher_id: int):
-    """Create a new student and assign to teacher"""
+def create_student(db: Session, student: StudentCreate, teacher_id: int, commit: bool = True):
+    """Create a new student and assign to teacher; commit=False leaves the transaction open"""
     # Check for existing student per teacher (roll numbers are unique per teacher)
     existing = get_student_by_roll_number(db, student.roll_number, teacher_id)
     if existing:
         raise ValueError(f"Student with roll number {student.roll_number} already exists for this teacher")
     
-    db_student = Student(
-        roll_number=student.roll_number,
-        name=student.name,
-        class_name=student.class_name,
-        section=student.section,
-        branch=student.branch,
-        photo_url=student.photo_url,
-        teacher_id=teacher_id
-    )
-    
     try:
-        db.add(db_student)
-        db.commit()
-        db.refresh(db_student)
-        return db_student
+        return _insert_returning(db, Student, {
+            'roll_number': student.roll_number,
+            'name': student.name,
+            'class_name': student.class_name,
+            'section': student.section,
+            'branch': student.branch,
+            'photo_url': student.photo_url,
+            'teacher_id': teacher_id
+        }, commit=commit)
     except Exception as e:
-        db.rollback()
+        if commit:
+            db.rollback()
         raise e
 
 
@@ -121,18 +175,18 @@ def get_students(db: Session, skip: int = 0, limit: int = 100, teacher_id: Optio
 
 def get_student_by_id(db: Session, student_id: int):
     """Get student by ID"""
-    return db.query(Student).filter(Student.student_id == student_id).first()
+    return db.execute(select(Student).where(Student.student_id == student_id)).scalar_one_or_none()
 
 
 def get_student_by_roll_number(db: Session, roll_number: str, teacher_id: Optional[int] = None):
     """Get student by roll number, optionally filtered by teacher"""
-    query = db.query(Student).filter(Student.roll_number == roll_number)
+    stmt = select(Student).where(Student.roll_number == roll_number)
     
     # If teacher_id is provided, filter by teacher to allow same roll numbers across different teachers
     if teacher_id:
-        query = query.filter(Student.teacher_id == teacher_id)
+        stmt = stmt.where(Student.teacher_id == teacher_id)
     
-    return query.first()
+    return db.execute(stmt.limit(1)).scalar_one_or_none()
 
 
 def update_student(db: Session, student_id: int, student_update: StudentUpdate):
@@ -148,31 +202,39 @@ def update_student(db: Session, student_id: int, student_update: StudentUpdate):
     return db_student
 
 
+def _set_student_active(db: Session, student_id: int, is_active: bool) -> Optional[datetime]:
+    """Flip is_active in one UPDATE guarded on the current state; returns the timestamp if a row changed"""
+    now = datetime.now(timezone.utc)
+    result = db.execute(
+        update(Student)
+        .where(Student.student_id == student_id, Student.is_active == (not is_active))
+        .values(is_active=is_active, updated_at=now, deleted_at=None if is_active else now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return now if result.rowcount else None
+
+
+def _student_exists(db: Session, student_id: int) -> bool:
+    """Check whether a student row exists, active or not"""
+    return db.query(Student.student_id).filter(Student.student_id == student_id).first() is not None
+
+
 def delete_student(db: Session, student_id: int):
     """Enhanced soft delete with future-proof error handling and recovery options"""
     try:
-        db_student = get_student_by_id(db, student_id)
-        if not db_student:
-            return {"success": False, "message": "Student not found", "student_id": student_id}
-        
-        if not db_student.is_active:
+        # Soft delete with timestamp; a lookup is only needed when nothing was updated
+        deleted_at = _set_student_active(db, student_id, False)
+        if deleted_at is None:
+            if not _student_exists(db, student_id):
+                return {"success": False, "message": "Student not found", "student_id": student_id}
             return {"success": False, "message": "Student already deleted", "student_id": student_id}
         
-        # Soft delete with timestamp
-        db_student.is_active = False
-        db_student.updated_at = datetime.utcnow()
-        
-        # If deleted_at column exists, use it for better tracking
-        if hasattr(db_student, 'deleted_at'):
-            db_student.deleted_at = datetime.utcnow()
-        
-        db.commit()
-        
         return {
             "success": True, 
             "message": "Student soft-deleted successfully. Can be recovered if needed.",
             "student_id": student_id,
-            "deleted_at": db_student.updated_at.isoformat() if db_student.updated_at else None
+            "deleted_at": deleted_at.isoformat()
         }
         
     except Exception as e:
@@ -188,23 +250,12 @@ def delete_student(db: Session, student_id: int):
 def recover_student(db: Session, student_id: int):
     """Recover a soft-deleted student"""
     try:
-        db_student = get_student_by_id(db, student_id, include_inactive=True)
-        if not db_student:
-            return {"success": False, "message": "Student not found"}
-        
-        if db_student.is_active:
+        # Recover the student and clear deleted_at in one UPDATE
+        if _set_student_active(db, student_id, True) is None:
+            if not _student_exists(db, student_id):
+                return {"success": False, "message": "Student not found"}
             return {"success": False, "message": "Student is already active"}
         
-        # Recover the student
-        db_student.is_active = True
-        db_student.updated_at = datetime.utcnow()
-        
-        # Clear deleted_at if it exists
-        if hasattr(db_student, 'deleted_at'):
-            db_student.deleted_at = None
-        
-        db.commit()
-        
         return {
             "success": True,
             "message": "Student recovered successfully",
@@ -218,157 +269,268 @@ def recover_student(db: Session, student_id: int):
 
 def get_student_by_id(db: Session, student_id: int, include_inactive: bool = False):
     """Get student by ID with option to include inactive students"""
-    query = db.query(Student).filter(Student.student_id == student_id)
+    stmt = select(Student).where(Student.student_id == student_id)
     if not include_inactive:
-        query = query.filter(Student.is_active == True)
-    return query.first()
+        stmt = stmt.where(Student.is_active == True)
+    return db.execute(stmt).scalar_one_or_none()
 
 
-def bulk_import_students(db: Session, file_path: str, teacher_id: Optional[int] = None):
-    """Import students from CSV/Excel file with photo URL support and teacher isolation
-    Expected CSV format: Class, Section, Roll Number, Branch, Name, Photo
+def _insert_student_batch(db: Session, pending: List[tuple], errors: List[str]):
+    """Insert queued (index, name, roll_number, values) student rows in one statement
+    
+    Runs inside the caller's transaction. A SAVEPOINT isolates the batch, and when it
+    violates a constraint the rows are retried one savepoint each, so each failing row
+    is reported the same way a single create would report it.
+    Returns (imported_count, duplicate_count).
     """
-    import requests
-    import os
-    from PIL import Image
-    from io import BytesIO
+    try:
+        with db.begin_nested():
+            db.execute(insert(Student), [values for _, _, _, values in pending])
+        return len(pending), 0
+    except IntegrityError:
+        pass
+    
+    imported_count = duplicate_count = 0
+    for index, name, roll_number, values in pending:
+        try:
+            with db.begin_nested():
+                db.execute(insert(Student), [values])
+            imported_count += 1
+        except Exception as create_error:
+            # Handle specific database integrity errors
+            if "UNIQUE constraint failed" in str(create_error) and "uq_student_roll_teacher" in str(create_error):
+                error_msg = f"Row {index + 1} ({name}): Roll number {roll_number} already exists for this teacher"
+                duplicate_count += 1
+            else:
+                error_msg = f"Row {index + 1} ({name}): Database error - {str(create_error)}"
+            
+            errors.append(error_msg)
+            print(f"Error creating student: {error_msg}")
+    
+    return imported_count, duplicate_count
+
+
+def _read_import_chunks(file_path: str):
+    """Yield the rows of a CSV/Excel upload as DataFrames of at most IMPORT_READ_CHUNK_SIZE rows"""
+    if file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=IMPORT_READ_CHUNK_SIZE)
+        return
+    if not file_path.endswith(('.xlsx', '.xlsm')):
+        # Legacy .xls is not readable by openpyxl
+        yield pd.read_excel(file_path)
+        return
     
+    # openpyxl read-only mode streams rows instead of loading the whole workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
     try:
-        # Read file based on extension
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"Unnamed: {i}" if column is None else column for i, column in enumerate(header)]
         
-        print(f"CSV columns found: {list(df.columns)}")
+        batch = []
+        blank_rows = []  # blank rows count only when followed by data, as with read_excel
+        offset = 0
+        for row in rows:
+            if all(value is None for value in row):
+                blank_rows.append(row)
+                continue
+            batch.extend(blank_rows)
+            blank_rows.clear()
+            batch.append(row)
+            if len(batch) >= IMPORT_READ_CHUNK_SIZE:
+                yield pd.DataFrame(batch, columns=columns, index=range(offset, offset + len(batch)))
+                offset += len(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, index=range(offset, offset + len(batch)))
+    finally:
+        workbook.close()
+
+
+def _import_column_map(columns) -> dict:
+    """Map spreadsheet columns to student fields; the first column matching a field wins"""
+    col_map = {}
+    for column in columns:
+        field = IMPORT_COLUMN_ALIASES.get(str(column).casefold().strip())
+        if field and field not in col_map.values():
+            col_map[column] = field
+    return col_map
+
+
+def _save_student_photo(content: bytes, roll_number: str, photo_url: str) -> str:
+    """Resize a downloaded photo, save it under PHOTOS_DIR and return its relative path"""
+    # Create filename from roll number
+    file_extension = photo_url.split('.')[-1].lower()
+    if file_extension not in PHOTO_FORMATS:
+        file_extension = 'jpg'
+    
+    filename = f"{roll_number}.{file_extension}"
+    
+    photo_path = os.path.join(PHOTOS_DIR, filename)
+    target_format = PHOTO_FORMATS[file_extension]
+    
+    # Image.open only parses the header, so small photos are never decoded
+    img = Image.open(BytesIO(content))
+    if img.width <= PHOTO_MAX_SIZE[0] and img.height <= PHOTO_MAX_SIZE[1] and img.format == target_format:
+        # Already small and in the target format - keep the original bytes
+        with open(photo_path, 'wb') as photo_file:
+            photo_file.write(content)
+    else:
+        img.thumbnail(PHOTO_MAX_SIZE, Image.BILINEAR)
+        if target_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(photo_path, target_format, quality=85)
+    
+    return f"photos/{filename}"
+
+
+def _download_student_photos(photo_jobs: List[tuple], errors: List[str]):
+    """Download and save photos concurrently; photo_jobs holds (index, name, roll_number, photo_url)"""
+    os.makedirs(PHOTOS_DIR, exist_ok=True)
+    photo_errors = []
+    
+    def record_error(index, name, photo_error):
+        print(f"Photo download error for {name}: {str(photo_error)}")
+        photo_errors.append((index, f"Row {index + 1} ({name}): Failed to download photo - {str(photo_error)}"))
+    
+    with ThreadPoolExecutor(max_workers=PHOTO_DOWNLOAD_WORKERS) as download_pool, \
+            ThreadPoolExecutor(max_workers=PHOTO_PROCESS_WORKERS) as image_pool:
+        downloads = {
+            download_pool.submit(_HTTP.get, job[3], timeout=10): job
+            for job in photo_jobs
+        }
         
+        # Hand each finished download straight to the image pool
+        saves = {}
+        for future in as_completed(downloads):
+            index, name, roll_number, photo_url = downloads[future]
+            try:
+                response = future.result()
+            except Exception as photo_error:
+                record_error(index, name, photo_error)
+                continue
+            if response.status_code == 200:
+                saves[image_pool.submit(_save_student_photo, response.content, roll_number, photo_url)] = downloads[future]
+        
+        for future in as_completed(saves):
+            index, name, roll_number, photo_url = saves[future]
+            try:
+                photo_path = future.result()
+                print(f"Downloaded photo for {name}: {photo_path}")
+            except Exception as photo_error:
+                record_error(index, name, photo_error)
+    
+    errors.extend(message for _, message in sorted(photo_errors, key=lambda item: item[0]))
+
+
+def bulk_import_students(db: Session, file_path: str, teacher_id: Optional[int] = None):
+    """Import students from CSV/Excel file with photo URL support and teacher isolation
+    Expected CSV format: Class, Section, Roll Number, Branch, Name, Photo
+    """
+    try:
         imported_count = 0
         duplicate_count = 0
+        total_rows = 0
         errors = []
         
-        for index, row in df.iterrows():
-            try:
-                # Handle different possible column names (case-insensitive)
-                def get_column_value(possible_names):
-                    for name in possible_names:
-                        # Try exact match first
-                        if name in df.columns:
-                            return str(row[name]) if pd.notna(row[name]) else ''
-                        # Try case-insensitive match
-                        for col in df.columns:
-                            if col.lower().strip() == name.lower().strip():
-                                return str(row[col]) if pd.notna(row[col]) else ''
-                    return ''
-                
-                # Extract data using flexible column matching
-                roll_number = get_column_value(['Roll Number', 'roll_number', 'Roll', 'rollnumber'])
-                name = get_column_value(['Name', 'name', 'Student Name', 'student_name'])
-                class_name = get_column_value(['Class', 'class', 'class_name', 'Grade'])
-                section = get_column_value(['Section', 'section', 'Sec'])
-                branch = get_column_value(['Branch', 'branch', 'Stream', 'stream', 'Course'])
-                photo_url = get_column_value(['Photo', 'photo', 'Photo URL', 'photo_url', 'Image'])
+        # Roll numbers already taken for this teacher, fetched once for O(1) duplicate checks
+        existing_query = db.query(Student.roll_number)
+        if teacher_id:
+            existing_query = existing_query.filter(Student.teacher_id == teacher_id)
+        existing_roll_numbers = {roll for (roll,) in existing_query.yield_per(10000)}
+        
+        # The whole import is one transaction committed at the end; autoflush stays
+        # off so the per-row work never triggers implicit flushes
+        with db.no_autoflush:
+            # Rows are read, validated and inserted one chunk at a time to bound memory
+            for df in _read_import_chunks(file_path):
+                if total_rows == 0:
+                    print(f"CSV columns found: {list(df.columns)}")
+                total_rows += len(df)
                 
-                if not roll_number or not name:
-                    errors.append(f"Row {index + 1}: Missing required fields (Roll Number or Name)")
-                    continue
+                # Validated rows, inserted in batches once their photos are downloaded
+                pending = []
+                photo_jobs = []
                 
-                # Check if student already exists for this teacher (roll numbers are unique per teacher)
-                existing_student = get_student_by_roll_number(db, roll_number, teacher_id)
-                if existing_student:
-                    print(f"Student with roll number {roll_number} already exists for teacher {teacher_id}: {name}")
-                    duplicate_count += 1
-                    continue
+                # Map headers to student fields once instead of scanning columns per cell
+                col_map = _import_column_map(df.columns)
+                df = df[list(col_map)].rename(columns=col_map)
+                df = df.reindex(columns=IMPORT_FIELDS, fill_value='').fillna('')
                 
-                photo_path = None
+                # Plain string tuples avoid building a Series or namedtuple per row
+                values = df[IMPORT_FIELDS].astype(str).to_numpy()
                 
-                # Handle photo URL if provided
-                if photo_url and photo_url.startswith('http'):
+                for index, (roll_number, name, class_name, section, branch, photo_url) in zip(df.index, values):
                     try:
-                        # Convert Google Drive URL to direct download format
-                        photo_url = convert_google_drive_url(photo_url)
-                        
-                        # Create photos directory if it doesn't exist
-                        photos_dir = "static/photos"
-                        os.makedirs(photos_dir, exist_ok=True)
+                        if not roll_number or not name:
+                            errors.append(f"Row {index + 1}: Missing required fields (Roll Number or Name)")
+                            continue
                         
-                        # Download photo
-                        response = requests.get(photo_url, timeout=10)
-                        if response.status_code == 200:
-                            # Create filename from roll number
-                            file_extension = photo_url.split('.')[-1].lower()
-                            if file_extension not in ['jpg', 'jpeg', 'png', 'gif']:
-                                file_extension = 'jpg'
-                            
-                            filename = f"{roll_number}.{file_extension}"
-                            photo_path = os.path.join(photos_dir, filename)
-                            
-                            # Save and optimize photo
-                            img = Image.open(BytesIO(response.content))
-                            # Resize if too large
-                            if img.width > 300 or img.height > 300:
-                                img.thumbnail((300, 300), Image.LANCZOS)
-                            img.save(photo_path, quality=85)
-                            
-                            # Store relative path
-                            photo_path = f"photos/{filename}"
-                            print(f"Downloaded photo for {name}: {photo_path}")
-                            
-                    except Exception as photo_error:
-                        print(f"Photo download error for {name}: {str(photo_error)}")
-                        errors.append(f"Row {index + 1} ({name}): Failed to download photo - {str(photo_error)}")
-                        photo_path = None
-                
-                # Create student record
-                student_data = StudentCreate(
-                    roll_number=roll_number,
-                    name=name,
-                    class_name=class_name,
-                    section=section,
-                    branch=branch,  # Map Branch to branch (not stream)
-                    photo_url=photo_url  # Store the original URL
-                )
-                
-                # Only create student if teacher_id is provided (for teacher isolation)
-                if teacher_id:
-                    try:
-                        new_student = create_student(db, student_data, teacher_id)
-                        imported_count += 1
-                        print(f"Imported student: {name} (Roll: {roll_number}) for teacher {teacher_id}")
-                    except Exception as create_error:
-                        # Handle specific database integrity errors
-                        if "UNIQUE constraint failed" in str(create_error) and "uq_student_roll_teacher" in str(create_error):
-                            error_msg = f"Row {index + 1} ({name}): Roll number {roll_number} already exists for this teacher"
+                        # Check if student already exists for this teacher (roll numbers are unique per teacher)
+                        if roll_number in existing_roll_numbers:
+                            print(f"Student with roll number {roll_number} already exists for teacher {teacher_id}: {name}")
                             duplicate_count += 1
+                            continue
+                        
+                        # Photos are fetched concurrently once every row has been validated
+                        if photo_url and photo_url.startswith('http'):
+                            # Convert Google Drive URL to direct download format
+                            photo_url = convert_google_drive_url(photo_url)
+                            photo_jobs.append((index, name, roll_number, photo_url))
+                        
+                        # Create student record
+                        student_data = StudentCreate(
+                            roll_number=roll_number,
+                            name=name,
+                            class_name=class_name,
+                            section=section,
+                            branch=branch,  # Map Branch to branch (not stream)
+                            photo_url=photo_url  # Store the original URL
+                        )
+                        
+                        # Only create student if teacher_id is provided (for teacher isolation)
+                        if teacher_id:
+                            pending.append((index, name, roll_number, {
+                                **student_data.dict(),
+                                'teacher_id': teacher_id
+                            }))
+                            existing_roll_numbers.add(roll_number)
                         else:
-                            error_msg = f"Row {index + 1} ({name}): Database error - {str(create_error)}"
+                            # Legacy support - create without teacher assignment (not recommended)
+                            print(f"Warning: No teacher_id provided for student: {name} (Roll: {roll_number})")
+                            continue
                         
+                    except Exception as e:
+                        error_msg = f"Row {index + 1}: {str(e)}"
                         errors.append(error_msg)
-                        print(f"Error creating student: {error_msg}")
-                        
-                        # Rollback the current transaction to continue with next student
-                        db.rollback()
-                        continue
-                else:
-                    # Legacy support - create without teacher assignment (not recommended)
-                    print(f"Warning: No teacher_id provided for student: {name} (Roll: {roll_number})")
-                    continue
+                        print(f"Error importing row {index + 1}: {str(e)}")
+                
+                if photo_jobs:
+                    _download_student_photos(photo_jobs, errors)
                 
-            except Exception as e:
-                error_msg = f"Row {index + 1}: {str(e)}"
-                errors.append(error_msg)
-                print(f"Error importing row {index + 1}: {str(e)}")
+                for start in range(0, len(pending), IMPORT_BATCH_SIZE):
+                    imported, duplicates = _insert_student_batch(db, pending[start:start + IMPORT_BATCH_SIZE], errors)
+                    imported_count += imported
+                    duplicate_count += duplicates
+        
+        db.commit()
+        
+        print(f"Imported {imported_count} students for teacher {teacher_id}")
         
         result = {
             "imported_count": imported_count,
             "duplicate_count": duplicate_count,
             "errors": errors,
-            "total_rows": len(df)
+            "total_rows": total_rows
         }
         
-        print(f"Import completed: {imported_count}/{len(df)} students imported, {duplicate_count} duplicates skipped")
+        print(f"Import completed: {imported_count}/{total_rows} students imported, {duplicate_count} duplicates skipped")
         return result
     
     except Exception as e:
+        db.rollback()
         error_msg = f"File processing error: {str(e)}"
         print(error_msg)
         return {
@@ -381,17 +543,13 @@ def bulk_import_students(db: Session, file_path: str, teacher_id: Optional[int]
 # Class CRUD operations
 def create_class(db: Session, class_data: ClassCreate):
     """Create a new class"""
-    db_class = Class(
-        class_name=class_data.class_name,
-        section=class_data.section,
-        stream=class_data.stream,
-        subject=class_data.subject,
-        teacher_id=class_data.teacher_id
-    )
-    db.add(db_class)
-    db.commit()
-    db.refresh(db_class)
-    return db_class
+    return _insert_returning(db, Class, {
+        'class_name': class_data.class_name,
+        'section': class_data.section,
+        'stream': class_data.stream,
+        'subject': class_data.subject,
+        'teacher_id': class_data.teacher_id
+    })
 
 
 def get_classes(db: Session, teacher_id: Optional[int] = None, skip: int = 0, limit: int = 100):
@@ -406,7 +564,7 @@ def get_classes(db: Session, teacher_id: Optional[int] = None, skip: int = 0, li
 
 def get_class_by_id(db: Session, class_id: int):
     """Get class by ID"""
-    return db.query(Class).filter(Class.class_id == class_id).first()
+    return db.execute(select(Class).where(Class.class_id == class_id)).scalar_one_or_none()
 
 
 def update_class(db: Session, class_id: int, class_update: ClassUpdate):
@@ -430,11 +588,7 @@ def add_student_to_class(db: Session, student_id: int, class_id: int):
     ).first()
     
     if not existing:
-        student_class = StudentClass(student_id=student_id, class_id=class_id)
-        db.add(student_class)
-        db.commit()
-        db.refresh(student_class)
-        return student_class
+        return _insert_returning(db, StudentClass, {'student_id': student_id, 'class_id': class_id})
     return existing
 
 
@@ -490,22 +644,65 @@ def mark_attendance(db: Session, attendance: AttendanceCreate, teacher_id: int):
         return db_attendance
 
 
+def bulk_upsert_attendance(db: Session, records: List[AttendanceCreate], teacher_id: int):
+    """Mark many attendance records (e.g. one face-recognition batch) in a single upsert"""
+    # The last record wins for a repeated student/date, as sequential marking would
+    latest = {}
+    for attendance_data in records:
+        attendance_date = attendance_data.attendance_date or date.today()
+        latest[(attendance_data.student_id, attendance_date)] = (attendance_data, attendance_date)
+    
+    upsert_insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert_insert is None:
+        # No native upsert - fall back to one mark per student
+        return [mark_attendance(db, attendance_data, teacher_id) for attendance_data, _ in latest.values()]
+    if not latest:
+        return []
+    
+    # One INSERT ... ON CONFLICT (student_id, attendance_date) DO UPDATE for the whole batch
+    stmt = upsert_insert(Attendance).values([
+        {
+            'student_id': attendance_data.student_id,
+            'teacher_id': teacher_id,
+            'status': attendance_data.status,
+            'attendance_type': attendance_data.attendance_type,
+            'confidence_score': attendance_data.confidence_score,
+            'attendance_date': attendance_date,
+            'notes': attendance_data.notes
+        }
+        for attendance_data, attendance_date in latest.values()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['student_id', 'attendance_date'],
+        set_={
+            'teacher_id': stmt.excluded.teacher_id,
+            'status': stmt.excluded.status,
+            'attendance_type': stmt.excluded.attendance_type,
+            'confidence_score': stmt.excluded.confidence_score,
+            'notes': stmt.excluded.notes,
+            'marked_at': datetime.utcnow()
+        }
+    ).returning(Attendance)
+    
+    results = db.scalars(stmt).all()
+    db.commit()
+    return results
+
+
 def bulk_mark_attendance(db: Session, bulk_attendance: AttendanceBulkCreate, teacher_id: int):
     """Mark attendance for multiple students"""
-    results = []
     attendance_date = bulk_attendance.attendance_date or date.today()
     
-    for student_status in bulk_attendance.student_statuses:
-        attendance_data = AttendanceCreate(
+    # Validate every status up front, then write them all in one upsert
+    records = [
+        AttendanceCreate(
             student_id=student_status['student_id'],
             status=student_status['status'],
             attendance_date=attendance_date
         )
-        
-        result = mark_attendance(db, attendance_data, teacher_id)
-        results.append(result)
-    
-    return results
+        for student_status in bulk_attendance.student_statuses
+    ]
+    return bulk_upsert_attendance(db, records, teacher_id)
 
 
 def get_attendance_records(
@@ -542,9 +739,13 @@ def get_attendance_statistics(db: Session, class_id: Optional[int] = None, teach
     if teacher_id:
         query = query.filter(Attendance.teacher_id == teacher_id)
     
-    total_attendance = query.count()
-    present_count = query.filter(Attendance.status == 'Present').count()
-    absent_count = query.filter(Attendance.status == 'Absent').count()
+    # One grouped scan instead of separate total/present/absent counts
+    status_counts = dict(
+        query.with_entities(Attendance.status, func.count()).group_by(Attendance.status).all()
+    )
+    total_attendance = sum(status_counts.values())
+    present_count = status_counts.get('Present', 0)
+    absent_count = status_counts.get('Absent', 0)
     
     attendance_percentage = (present_count / total_attendance * 100) if total_attendance > 0 else 0
     
@@ -558,10 +759,16 @@ def get_attendance_statistics(db: Session, class_id: Optional[int] = None, teach
 
 def get_student_attendance_stats(db: Session, student_id: int):
     """Get detailed attendance statistics for a student"""
-    attendance_records = db.query(Attendance).filter(Attendance.student_id == student_id).all()
+    # Count per status in the database rather than loading every record
+    status_counts = dict(
+        db.query(Attendance.status, func.count())
+        .filter(Attendance.student_id == student_id)
+        .group_by(Attendance.status)
+        .all()
+    )
     
-    total_days = len(attendance_records)
-    present_days = len([r for r in attendance_records if r.status == 'Present'])
+    total_days = sum(status_counts.values())
+    present_days = status_counts.get('Present', 0)
     absent_days = total_days - present_days
     
     attendance_percentage = (present_days / total_days * 100) if total_days > 0 else 0
@@ -1,12 +1,14 @@
 """
 Enhanced CRUD operations for string-based IDs and teacher isolation
 """
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, extract
+from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy import and_, func, extract, select
 from typing import List, Optional
 from datetime import date, datetime, time
 import json
+import secrets
 import uuid
+from time import time_ns
 from backend.models_new import Teacher, Student, Class, AttendanceRecord, AttendanceSession
 from backend.schemas_new import (
     TeacherCreate, TeacherUpdate, StudentCreate, StudentUpdate,
@@ -19,7 +21,10 @@ def generate_teacher_id(name: str, email: str) -> str:
     """Generate unique teacher ID"""
     name_part = name.replace(" ", "_").lower()[:10]
     email_part = email.split("@")[0][:5]
-    return f"TCH_{name_part}_{email_part}_{int(datetime.now().timestamp())}"
+    # Low nanosecond-clock bits plus random hex: teachers created within the
+    # same second no longer collide
+    suffix = f"{time_ns():x}"[-8:] + secrets.token_hex(2)
+    return f"TCH_{name_part}_{email_part}_{suffix}"
 
 
 def generate_class_id(class_name: str, section: str, teacher_id: str) -> str:
@@ -61,12 +66,12 @@ def create_teacher(db: Session, teacher: TeacherCreate):
 
 def get_teacher_by_email(db: Session, email: str):
     """Get teacher by email"""
-    return db.query(Teacher).filter(Teacher.email == email).first()
+    return db.execute(select(Teacher).where(Teacher.email == email)).scalar_one_or_none()
 
 
 def get_teacher_by_id(db: Session, teacher_id: str):
     """Get teacher by string ID"""
-    return db.query(Teacher).filter(Teacher.teacher_id == teacher_id).first()
+    return db.execute(select(Teacher).where(Teacher.teacher_id == teacher_id)).scalar_one_or_none()
 
 
 # Class CRUD operations
@@ -137,7 +142,8 @@ def create_student(db: Session, student: StudentCreate, teacher_id: str):
 
 def get_students_by_teacher(db: Session, teacher_id: str, skip: int = 0, limit: int = 100):
     """Get all students for a specific teacher"""
-    return db.query(Student).join(Class).filter(
+    # contains_eager fills class_ref from the filtering join, so no lazy load follows
+    return db.query(Student).join(Class).options(contains_eager(Student.class_ref)).filter(
         and_(
             Class.teacher_id == teacher_id,
             Student.is_active == True
@@ -147,18 +153,19 @@ def get_students_by_teacher(db: Session, teacher_id: str, skip: int = 0, limit:
 
 def get_student_by_id(db: Session, student_id: str):
     """Get student by string ID"""
-    return db.query(Student).filter(Student.student_id == student_id).first()
+    return db.execute(select(Student).where(Student.student_id == student_id)).scalar_one_or_none()
 
 
 def get_student_by_roll_and_teacher(db: Session, roll_number: str, teacher_id: str):
     """Get student by roll number within teacher's classes"""
-    return db.query(Student).join(Class).filter(
-        and_(
+    # contains_eager fills class_ref from the filtering join, so no lazy load follows
+    return db.execute(
+        select(Student).join(Class).options(contains_eager(Student.class_ref)).where(
             Student.roll_number == roll_number,
             Class.teacher_id == teacher_id,
             Student.is_active == True
-        )
-    ).first()
+        ).limit(1)
+    ).scalar_one_or_none()
 
 
 # Attendance CRUD operations
@@ -189,14 +196,10 @@ def mark_attendance(db: Session, student_id: str, teacher_id: str,
     ).first()
     
     if existing_record:
-        # Update existing record
-        db.query(AttendanceRecord).filter(
-            AttendanceRecord.record_id == record_id
-        ).update({
-            AttendanceRecord.status: status,
-            AttendanceRecord.notes: notes,
-            AttendanceRecord.updated_at: datetime.utcnow()
-        })
+        # Update the loaded record in place; flush emits a single UPDATE
+        existing_record.status = status
+        existing_record.notes = notes
+        existing_record.updated_at = datetime.utcnow()
         db.commit()
         return existing_record
     else:
@@ -3,43 +3,84 @@ Enhanced CSV import system with proper teacher isolation and Google Drive URL ha
 """
 import pandas as pd
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+from sqlalchemy import insert, select
 from backend.database import SessionLocal
-from backend.crud import create_student, get_teacher_by_id, get_student_by_roll_number
+from backend.models import Student
+from backend.crud import create_student, get_teacher_by_id
 from backend.schemas import StudentCreate
 
 
+REQUIRED_COLUMNS = ['Class', 'Section', 'Roll Number', 'Branch', 'Name', 'Photo']
+_REQUIRED_COLUMN_SET = frozenset(REQUIRED_COLUMNS)
+
+_GDRIVE_HOST = 'drive.google.com'
+
+# The three Drive URL formats in priority order; each alternative scans the whole URL
+# before the next one is tried, matching the sequential re.search fallbacks
+_GDRIVE_FILE_ID_RE = re.compile(
+    r'^(?:.*?/file/d/([a-zA-Z0-9_-]+)|.*?id=([a-zA-Z0-9_-]+)|.*?/d/([a-zA-Z0-9_-]+))'
+)
+
+
 def convert_google_drive_url(url: str) -> str:
     """Convert Google Drive share URL to direct access URL"""
-    if not url or 'drive.google.com' not in url:
+    if not url or _GDRIVE_HOST not in url:
         return url
     
     # Extract file ID from various Google Drive URL formats
-    patterns = [
-        r'/file/d/([a-zA-Z0-9_-]+)',
-        r'id=([a-zA-Z0-9_-]+)',
-        r'/d/([a-zA-Z0-9_-]+)'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            file_id = match.group(1)
-            return f'https://drive.google.com/uc?export=view&id={file_id}'
+    match = _GDRIVE_FILE_ID_RE.match(url)
+    if match:
+        file_id = next(group for group in match.groups() if group)
+        return f'https://drive.google.com/uc?export=view&id={file_id}'
     
     return url
 
 
+def convert_google_drive_urls(urls: pd.Series) -> pd.Series:
+    """Vectorized convert_google_drive_url for a column of photo URLs"""
+    # First non-empty group, i.e. the highest-priority pattern that matched
+    file_ids = urls.str.extract(_GDRIVE_FILE_ID_RE).bfill(axis=1).iloc[:, 0]
+    is_drive = urls.str.contains(_GDRIVE_HOST, regex=False) & file_ids.notna()
+    return urls.where(~is_drive, 'https://drive.google.com/uc?export=view&id=' + file_ids)
+
+
 def validate_csv_columns(df: pd.DataFrame) -> List[str]:
     """Validate CSV has required columns"""
-    required_columns = ['Class', 'Section', 'Roll Number', 'Branch', 'Name', 'Photo']
-    missing_columns = []
+    # Set membership keeps the missing columns in REQUIRED_COLUMNS order (Index.difference would sort them)
+    columns = set(df.columns)
+    return [col for col in REQUIRED_COLUMNS if col not in columns]
+
+
+def _insert_students(db, pending: List[tuple], teacher_id, errors: List[str]) -> Tuple[int, int]:
+    """Insert queued (index, StudentCreate) rows in one executemany; returns (imported, failed)"""
+    try:
+        student_ids = db.scalars(
+            insert(Student).returning(Student.student_id, sort_by_parameter_order=True),
+            [{**student_data.dict(), 'teacher_id': teacher_id} for _, student_data in pending]
+        ).all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        student_ids = None
     
-    for col in required_columns:
-        if col not in df.columns:
-            missing_columns.append(col)
+    if student_ids is not None:
+        for (_, student_data), student_id in zip(pending, student_ids):
+            print(f"✅ Imported: {student_data.name} (Roll: {student_data.roll_number}) -> {student_id}")
+        return len(student_ids), 0
     
-    return missing_columns
+    # The batch hit a constraint; retry row by row so each failure is reported on its own
+    imported_count = failed_count = 0
+    for index, student_data in pending:
+        try:
+            created_student = create_student(db, student_data, teacher_id)
+            print(f"✅ Imported: {student_data.name} (Roll: {student_data.roll_number}) -> {created_student.student_id}")
+            imported_count += 1
+        except Exception as e:
+            failed_count += 1
+            errors.append(f"Error processing row {index + 1}: {str(e)}")
+            print(f"Error processing {student_data.name}: {str(e)}")
+    return imported_count, failed_count
 
 
 def import_students_from_csv(file_path: str, teacher_id: str) -> Dict[str, Any]:
@@ -63,9 +104,17 @@ def import_students_from_csv(file_path: str, teacher_id: str) -> Dict[str, Any]:
                 'error': f'Teacher with ID {teacher_id} not found'
             }
         
-        # Read CSV file
+        # Read CSV file: only the needed columns, as plain strings with no NaN detection.
+        # usecols is a callable so a missing column is reported by validate_csv_columns, not the parser
         try:
-            df = pd.read_csv(file_path)
+            df = pd.read_csv(
+                file_path,
+                usecols=lambda column: column in _REQUIRED_COLUMN_SET,
+                dtype=str,
+                keep_default_na=False,
+                na_filter=False,
+                engine='c'
+            )
         except Exception as e:
             return {
                 'success': False,
@@ -81,6 +130,13 @@ def import_students_from_csv(file_path: str, teacher_id: str) -> Dict[str, Any]:
             }
         
         print(f"CSV columns found: {list(df.columns)}")
+        total_rows = len(df)
+        
+        # Vectorized cleaning; rows left without a name or roll number are skipped below
+        df = df[REQUIRED_COLUMNS].apply(lambda column: column.str.strip())
+        
+        # Google Drive links are rewritten in one pass
+        df['Photo'] = convert_google_drive_urls(df['Photo'])
         
         # Process each row
         imported_count = 0
@@ -88,33 +144,28 @@ def import_students_from_csv(file_path: str, teacher_id: str) -> Dict[str, Any]:
         error_count = 0
         errors = []
         
-        for index, row in df.iterrows():
+        # Validated (index, StudentCreate) rows, inserted together after the loop
+        pending = []
+        
+        # Roll numbers this teacher already has, fetched once for set lookups
+        existing_roll_numbers = set(db.scalars(
+            select(Student.roll_number).where(Student.teacher_id == teacher_id)
+        ))
+        
+        for index, class_name, section, roll_number, branch, name, photo_url in df.itertuples(name=None):
             try:
-                # Extract data from row
-                class_name = str(row['Class']).strip()
-                section = str(row['Section']).strip()
-                roll_number = str(row['Roll Number']).strip()
-                branch = str(row['Branch']).strip()
-                name = str(row['Name']).strip()
-                photo_url = str(row['Photo']).strip()
-                
                 # Skip empty rows
                 if not name or not roll_number:
                     continue
                 
                 # Check if student already exists for this teacher
-                existing_student = get_student_by_roll_number(db, roll_number)
-                if existing_student:
+                if roll_number in existing_roll_numbers:
                     print(f"Student already exists: {name} (Roll: {roll_number})")
                     duplicate_count += 1
                     continue
                 
-                # Convert Google Drive URL
-                if photo_url and photo_url != 'nan':
-                    photo_url = convert_google_drive_url(photo_url)
+                if photo_url:
                     print(f"Converted photo URL for {name}: {photo_url[:60]}...")
-                else:
-                    photo_url = None
                 
                 # Create student data
                 student_data = StudentCreate(
@@ -123,23 +174,22 @@ def import_students_from_csv(file_path: str, teacher_id: str) -> Dict[str, Any]:
                     class_name=class_name,
                     section=section,
                     branch=branch,
-                    photo_url=photo_url
+                    photo_url=photo_url or None
                 )
                 
-                # Create student
-                created_student = create_student(db, student_data, teacher_id)
-                if created_student:
-                    print(f"✅ Imported: {name} (Roll: {roll_number}) -> {created_student.student_id}")
-                    imported_count += 1
-                else:
-                    error_count += 1
-                    errors.append(f"Failed to create student: {name}")
+                # Queue student for the batched INSERT
+                pending.append((index, student_data))
+                existing_roll_numbers.add(roll_number)
                 
             except Exception as e:
                 error_count += 1
                 errors.append(f"Error processing row {index + 1}: {str(e)}")
                 print(f"Error processing {name if 'name' in locals() else 'unknown'}: {str(e)}")
         
+        if pending:
+            imported_count, failed_count = _insert_students(db, pending, teacher_id, errors)
+            error_count += failed_count
+        
         # Return results
         return {
             'success': True,
@@ -147,8 +197,8 @@ def import_students_from_csv(file_path: str, teacher_id: str) -> Dict[str, Any]:
             'duplicate_count': duplicate_count,
             'error_count': error_count,
             'errors': errors,
-            'total_processed': len(df),
-            'message': f"Import completed: {imported_count}/{len(df)} students imported, {duplicate_count} duplicates skipped"
+            'total_processed': total_rows,
+            'message': f"Import completed: {imported_count}/{total_rows} students imported, {duplicate_count} duplicates skipped"
         }
         
     except Exception as e:
@@ -1,7 +1,7 @@
 """
 Database configuration and connection management
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from decouple import config
@@ -18,17 +18,35 @@ if isinstance(DATABASE_URL, bool):
 if DATABASE_URL.startswith('sqlite'):
     engine = create_engine(
         DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        pool_pre_ping=True,
+        connect_args={"check_same_thread": False},  # No pool_pre_ping: a local file connection cannot go stale
         echo=False
     )
+    
+    # pysqlite defers BEGIN on its own, which breaks SAVEPOINTs (a RELEASE would commit
+    # the outer transaction); let SQLAlchemy emit BEGIN instead
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def _emit_sqlite_begin(conn):
+        conn.exec_driver_sql("BEGIN")
 else:
     # For PostgreSQL
+    # psycopg2 runs executemany UPDATE/DELETE one statement per row unless batch mode
+    # is on; psycopg 3 pipelines executemany by itself
+    driver_options = {}
+    if make_url(DATABASE_URL).get_driver_name() == 'psycopg2':
+        driver_options = {'executemany_mode': 'values_plus_batch', 'executemany_batch_page_size': 500}
     engine = create_engine(
         DATABASE_URL,
+        pool_size=20,        # Persistent connections, enough for concurrent imports and requests
+        max_overflow=40,     # Extra connections allowed under bursts
         pool_pre_ping=True,  # Verify connections before use
         pool_recycle=300,    # Recreate connections every 5 minutes
-        echo=False           # Set to True for SQL query logging
+        insertmanyvalues_page_size=10000,  # Rows per multi-VALUES INSERT for bulk imports
+        echo=False,          # Set to True for SQL query logging
+        **driver_options
     )
 
 # Create session factory
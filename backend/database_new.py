@@ -1,7 +1,7 @@
 """
 New database setup with string-based IDs and teacher isolation
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
@@ -16,8 +16,22 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is required")
 
-# Create engine
-engine = create_engine(DATABASE_URL)
+# Create engine with a pool sized for concurrent imports; psycopg2 needs batch mode
+# for fast executemany UPDATE/DELETE
+url = make_url(DATABASE_URL)
+if url.get_driver_name() == 'psycopg2':
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=20,
+        max_overflow=40,
+        executemany_mode='values_plus_batch',
+        executemany_batch_page_size=500
+    )
+elif url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+    # In-memory SQLite uses SingletonThreadPool, which takes no pool sizing
+    engine = create_engine(DATABASE_URL)
+else:
+    engine = create_engine(DATABASE_URL, pool_size=20, max_overflow=40)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -5,12 +5,106 @@ import cv2
 import numpy as np
 import os
 import json
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from PIL import Image
-from io import BytesIO
 import logging
 from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Optional ArcFace embedding backend (used when the ONNX model file is present)
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+# ArcFace input size (width, height)
+EMBEDDING_INPUT_SIZE = (112, 112)
+
+# Concurrent photo downloads in process_all_students_from_db
+DOWNLOAD_WORKERS = 32
+DOWNLOAD_BATCH_SIZE = 128
+
+def _build_http_session() -> requests.Session:
+    """Shared session so photo downloads reuse pooled keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS,
+                          max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_HTTP = _build_http_session()
+
+# Rows of the uint8 template matrix widened to float32 per GEMV call (keeps the buffer in cache)
+TEMPLATE_BLOCK_ROWS = 8
+
+@lru_cache(maxsize=None)
+def _lbp_coordinates(radius: int, n_points: int, rows: int, cols: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Neighbour row/col lookup tables for an LBP ring, shape (n_points, rows) and (n_points, cols)"""
+    angles = 2 * np.pi * np.arange(n_points) / n_points
+    # int(i + radius * cos(angle)) per row/col so float rounding matches the per-pixel loop
+    xs = (np.arange(rows)[None, :] + radius * np.cos(angles)[:, None]).astype(np.int64)
+    ys = (np.arange(cols)[None, :] + radius * np.sin(angles)[:, None]).astype(np.int64)
+    return np.clip(xs, 0, rows - 1), np.clip(ys, 0, cols - 1)
+
+def _uint8_matvec(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """matrix @ vector for a uint8 matrix, widening a few rows at a time instead of the whole matrix"""
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    block = np.empty((TEMPLATE_BLOCK_ROWS, matrix.shape[1]), dtype=np.float32)
+    for start in range(0, matrix.shape[0], TEMPLATE_BLOCK_ROWS):
+        rows = matrix[start:start + TEMPLATE_BLOCK_ROWS]
+        np.copyto(block[:len(rows)], rows, casting='unsafe')
+        np.dot(block[:len(rows)], vector, out=out[start:start + len(rows)])
+    return out
+
+def _rows_version(ids: List[str], matrix: np.ndarray) -> str:
+    """Short digest of a row matrix and its ids"""
+    digest = hashlib.sha1(json.dumps(ids).encode('utf-8'))
+    digest.update(np.ascontiguousarray(matrix).tobytes())
+    return digest.hexdigest()[:16]
+
+def _versioned_path(matrix_path: Path, version: str) -> Path:
+    """Matrix file for one version, e.g. face_templates.<version>.npy"""
+    return matrix_path.with_name(f"{matrix_path.stem}.{version}.npy")
+
+def _save_rows(matrix_path: Path, manifest_path: Path, rows: Dict[str, np.ndarray]):
+    """Write rows as one contiguous versioned .npy matrix plus a JSON manifest of its version and ids"""
+    ids = list(rows)
+    matrix = np.stack([rows[k] for k in ids])
+    version = _rows_version(ids, matrix)
+    # os.replace onto a memory-mapped file fails on Windows, so each version gets a new file
+    current = _versioned_path(matrix_path, version)
+    if not current.exists():
+        tmp_path = current.with_name(current.stem + '.tmp.npy')
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, current)
+    # The manifest is never mapped, so it can be swapped in atomically
+    tmp_manifest = manifest_path.with_name(manifest_path.stem + '.tmp.json')
+    with open(tmp_manifest, 'w') as f:
+        json.dump({'version': version, 'ids': ids}, f)
+    os.replace(tmp_manifest, manifest_path)
+    # Older versions go once nothing maps them; Windows refuses while one still does
+    for old_path in [matrix_path, *matrix_path.parent.glob(f"{matrix_path.stem}.*.npy")]:
+        if old_path != current and old_path.exists():
+            try:
+                old_path.unlink()
+            except OSError:
+                pass
+
+def _load_rows(matrix_path: Path, manifest_path: Path) -> Tuple[List[str], np.ndarray]:
+    """Memory-map a matrix written by _save_rows, checking it against its manifest"""
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    ids = manifest['ids']
+    matrix = np.load(_versioned_path(matrix_path, manifest['version']), mmap_mode='r')
+    if len(ids) != len(matrix) or _rows_version(ids, matrix) != manifest['version']:
+        raise ValueError(f"{manifest_path} does not match its matrix")
+    return ids, matrix
 
 class EnhancedFaceRecognition:
     def __init__(self, faces_dir: str = "faces"):
@@ -18,11 +112,39 @@ class EnhancedFaceRecognition:
         self.faces_dir.mkdir(exist_ok=True)
         self.face_data_file = self.faces_dir / "face_data.json"
         self.face_data = {}
+        # Prepared face templates keyed by student_id, persisted as one memory-mapped matrix
+        self.templates_file = self.faces_dir / "face_templates.npy"  # Saved as face_templates.<version>.npy
+        self.template_ids_file = self.faces_dir / "face_template_ids.json"  # Current version and its ids
+        self._templates: Dict[str, np.ndarray] = {}
+        # Equalized uint8 template rows and their centered norms, rebuilt lazily after changes
+        self._template_ids: List[str] = []
+        self._template_matrix: Optional[np.ndarray] = None
+        self._template_norms: Optional[np.ndarray] = None
+        
+        # ArcFace embeddings (L2-normalized), used instead of templates when the model is loaded.
+        # Students enrolled before the model was added need processing again to get one.
+        self.embedding_model_file = self.faces_dir / "arcface.onnx"
+        self.embeddings_file = self.faces_dir / "face_embeddings.npy"
+        self.embedding_ids_file = self.faces_dir / "face_embedding_ids.json"
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._embedding_ids: List[str] = []
+        self._embedding_matrix: Optional[np.ndarray] = None
+        self._ort = None
         
-        # Initialize OpenCV face detector
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # Initialize OpenCV face detector: YuNet when its model file is present, Haar cascade otherwise
+        self.face_detector_file = self.faces_dir / "face_detection_yunet.onnx"
+        self.face_detector = None
+        if self.face_detector_file.exists():
+            try:
+                self.face_detector = cv2.FaceDetectorYN.create(str(self.face_detector_file), "", (320, 320))
+            except Exception as e:
+                logging.warning(f"YuNet face detector unavailable, using Haar cascade: {e}")
+        if self.face_detector is None:
+            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
         
         self.load_face_data()
+        self._load_embedding_model()
+        self.load_embeddings()
         
     def load_face_data(self):
         """Load face data from file"""
@@ -33,6 +155,111 @@ class EnhancedFaceRecognition:
             except Exception as e:
                 logging.error(f"Error loading face data: {e}")
                 self.face_data = {}
+        self.load_templates()
+    
+    def load_templates(self):
+        """Memory-map the stored template matrix"""
+        self._templates = {}
+        self._template_matrix = None
+        self._template_norms = None
+        
+        if self.template_ids_file.exists():
+            try:
+                self._template_ids, self._template_matrix = _load_rows(self.templates_file, self.template_ids_file)
+                self._templates = dict(zip(self._template_ids, self._template_matrix))
+                return
+            except Exception as e:
+                logging.error(f"Error loading face templates: {e}")
+                self._template_matrix = None
+        
+        # Migrate per-student face images saved before the template matrix existed
+        for student_id, data in self.face_data.items():
+            face_path = data['face_path']
+            if os.path.exists(face_path):
+                stored_face = cv2.imread(face_path, cv2.IMREAD_GRAYSCALE)
+                if stored_face is not None:
+                    self._templates[student_id] = self._prepare_template(stored_face)
+        if self._templates:
+            self.save_templates()
+    
+    def save_templates(self):
+        """Save face templates to file"""
+        try:
+            _save_rows(self.templates_file, self.template_ids_file, self._templates)
+        except Exception as e:
+            logging.error(f"Error saving face templates: {e}")
+    
+    def _prepare_template(self, face: np.ndarray) -> np.ndarray:
+        """Resize, equalize and flatten a face to a uint8 vector"""
+        return cv2.equalizeHist(cv2.resize(face, (200, 200))).ravel()
+    
+    def _get_template_matrix(self) -> Optional[np.ndarray]:
+        """Stack prepared templates into an (N, 40000) uint8 matrix"""
+        if self._template_matrix is None and self._templates:
+            self._template_ids = list(self._templates)
+            self._template_matrix = np.stack([self._templates[k] for k in self._template_ids])
+        if self._template_norms is None and self._template_matrix is not None:
+            # Centered row norms, a block at a time so a memory-mapped matrix is read once without a full float copy
+            self._template_norms = np.empty(len(self._template_matrix), dtype=np.float32)
+            for start in range(0, len(self._template_matrix), 1024):
+                block = self._template_matrix[start:start + 1024].astype(np.float32)
+                block -= block.mean(axis=1, keepdims=True)
+                self._template_norms[start:start + 1024] = np.linalg.norm(block, axis=1) + 1e-7
+        return self._template_matrix
+    
+    def _load_embedding_model(self):
+        """Open an ONNX Runtime session for the ArcFace model (CUDA when available)"""
+        self._ort = None
+        if not ONNXRUNTIME_AVAILABLE or not self.embedding_model_file.exists():
+            return
+        
+        try:
+            self._ort = ort.InferenceSession(
+                str(self.embedding_model_file),
+                providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
+            )
+            self._ort_input_name = self._ort.get_inputs()[0].name
+            logging.info(f"ArcFace embedding backend ready ({self._ort.get_providers()[0]})")
+        except Exception as e:
+            logging.warning(f"ArcFace embedding backend unavailable, using template matching: {e}")
+            self._ort = None
+    
+    def load_embeddings(self):
+        """Memory-map the stored embedding matrix"""
+        self._embeddings = {}
+        self._embedding_matrix = None
+        if self.embedding_ids_file.exists():
+            try:
+                self._embedding_ids, self._embedding_matrix = _load_rows(self.embeddings_file, self.embedding_ids_file)
+                self._embeddings = dict(zip(self._embedding_ids, self._embedding_matrix))
+            except Exception as e:
+                logging.error(f"Error loading face embeddings: {e}")
+                self._embedding_matrix = None
+    
+    def save_embeddings(self):
+        """Save face embeddings to file"""
+        try:
+            _save_rows(self.embeddings_file, self.embedding_ids_file, self._embeddings)
+        except Exception as e:
+            logging.error(f"Error saving face embeddings: {e}")
+    
+    def _prepare_embedding_face(self, face: np.ndarray) -> np.ndarray:
+        """Resize a BGR face crop to the ArcFace input (RGB, CHW, scaled to [-1, 1])"""
+        face = cv2.cvtColor(cv2.resize(face, EMBEDDING_INPUT_SIZE), cv2.COLOR_BGR2RGB).astype(np.float32)
+        return ((face - 127.5) / 127.5).transpose(2, 0, 1)
+    
+    def _embed_faces(self, faces: List[np.ndarray]) -> np.ndarray:
+        """Embed BGR face crops in one batched forward pass, returning L2-normalized rows"""
+        batch = np.stack([self._prepare_embedding_face(face) for face in faces])
+        embeddings = self._ort.run(None, {self._ort_input_name: batch})[0].astype(np.float32)
+        return embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-7)
+    
+    def _get_embedding_matrix(self) -> Optional[np.ndarray]:
+        """Stack stored embeddings into an (N, D) matrix"""
+        if self._embedding_matrix is None and self._embeddings:
+            self._embedding_ids = list(self._embeddings)
+            self._embedding_matrix = np.stack([self._embeddings[k] for k in self._embedding_ids])
+        return self._embedding_matrix
     
     def save_face_data(self):
         """Save face data to file"""
@@ -42,29 +269,45 @@ class EnhancedFaceRecognition:
         except Exception as e:
             logging.error(f"Error saving face data: {e}")
     
+    def detect_faces(self, image: np.ndarray, gray: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Detect faces as (x, y, w, h) boxes in a BGR image (gray is its grayscale copy)"""
+        if self.face_detector is None:
+            return list(self.face_cascade.detectMultiScale(gray, 1.1, 4))
+        
+        height, width = gray.shape
+        self.face_detector.setInputSize((width, height))
+        _, faces = self.face_detector.detect(image)
+        if faces is None:
+            return []
+        
+        # YuNet boxes can extend past the frame; clip them to the image
+        boxes = []
+        for x, y, w, h in faces[:, :4].astype(int).tolist():
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 > x0 and y1 > y0:
+                boxes.append((x0, y0, x1 - x0, y1 - y0))
+        return boxes
+    
     def download_image_from_url(self, url: str) -> Optional[np.ndarray]:
         """Download image from URL and convert to OpenCV format"""
         try:
-            response = requests.get(url, timeout=10)
+            response = _HTTP.get(url, timeout=10)
             if response.status_code == 200:
-                # Convert to PIL Image first
-                image = Image.open(BytesIO(response.content))
-                # Convert to RGB if needed
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                # Convert to OpenCV format (BGR)
-                opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                return opencv_image
+                # Decode straight to BGR (None if the bytes are not an image)
+                return cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
             return None
         except Exception as e:
             logging.error(f"Error downloading image from {url}: {e}")
             return None
     
-    def extract_and_save_face(self, photo_url: str, student_id: str) -> bool:
-        """Extract face from Google Drive URL and save it"""
+    def extract_and_save_face(self, photo_url: str, student_id: str,
+                              image: Optional[np.ndarray] = None, persist: bool = True) -> bool:
+        """Extract face from Google Drive URL (or an already downloaded image) and save it"""
         try:
             # Download image
-            image = self.download_image_from_url(photo_url)
+            if image is None:
+                image = self.download_image_from_url(photo_url)
             if image is None:
                 return False
             
@@ -72,7 +315,7 @@ class EnhancedFaceRecognition:
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             
             # Detect faces
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            faces = self.detect_faces(image, gray)
             
             if len(faces) == 0:
                 logging.warning(f"No faces found in image for student {student_id}")
@@ -97,16 +340,30 @@ class EnhancedFaceRecognition:
             # Apply histogram equalization for better matching
             face_img = cv2.equalizeHist(face_img)
             
-            # Save face image
+            # Save face image (kept for inspection; recognition uses the template matrix)
             face_path = self.faces_dir / f"student_{student_id}.jpg"
-            cv2.imwrite(str(face_path), face_img)
+            encoded = cv2.imencode('.jpg', face_img)[1]
+            face_path.write_bytes(encoded.tobytes())
+            
+            # Template from the decoded JPEG, so it matches one rebuilt from the file later
+            self._templates[student_id] = self._prepare_template(cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE))
+            self._template_matrix = None
+            self._template_norms = None
+            
+            if self._ort is not None:
+                self._embeddings[student_id] = self._embed_faces([image[y:y+h, x:x+w]])[0]
+                self._embedding_matrix = None
             
             # Store face data
             self.face_data[student_id] = {
                 'face_path': str(face_path),
                 'photo_url': photo_url
             }
-            self.save_face_data()
+            if persist:
+                self.save_face_data()
+                self.save_templates()
+                if self._ort is not None:
+                    self.save_embeddings()
             
             logging.info(f"Successfully extracted and saved face for student {student_id}")
             return True
@@ -155,30 +412,24 @@ class EnhancedFaceRecognition:
         try:
             rows, cols = image.shape
             lbp = np.zeros((rows, cols), dtype=np.uint8)
+            xs, ys = _lbp_coordinates(radius, n_points, rows, cols)
+            inner_rows = slice(radius, rows - radius)
+            inner_cols = slice(radius, cols - radius)
+            center = image[inner_rows, inner_cols]
+            pattern = lbp[inner_rows, inner_cols]
             
-            for i in range(radius, rows - radius):
-                for j in range(radius, cols - radius):
-                    center = image[i, j]
-                    pattern = 0
-                    
-                    for p in range(n_points):
-                        # Calculate neighbor coordinates
-                        angle = 2 * np.pi * p / n_points
-                        x = int(i + radius * np.cos(angle))
-                        y = int(j + radius * np.sin(angle))
-                        
-                        # Compare with center
-                        if x >= 0 and x < rows and y >= 0 and y < cols:
-                            if image[x, y] >= center:
-                                pattern |= (1 << p)
-                    
-                    lbp[i, j] = pattern
+            # One array comparison per neighbour instead of a per-pixel loop
+            for p in range(n_points):
+                neighbors = image[np.ix_(xs[p, inner_rows], ys[p, inner_cols])]
+                pattern |= (neighbors >= center).astype(np.uint8) << p
             
             return lbp
             
         except Exception as e:
             logging.error(f"Error calculating LBP: {e}")
             return image
+    
+    def calculate_face_similarity(self, face1: np.ndarray, face2: np.ndarray) -> float:
         """Calculate similarity between two face images using template matching"""
         try:
             # Ensure both images are the same size
@@ -202,13 +453,13 @@ class EnhancedFaceRecognition:
             return 0.0
     
     def recognize_face_from_image(self, image: np.ndarray, threshold: float = 0.3) -> Optional[Dict]:
-        """Recognize face from image using template matching"""
+        """Recognize face from image using ArcFace embeddings when loaded, otherwise template matching"""
         try:
             # Convert to grayscale
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             
             # Detect faces
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            faces = self.detect_faces(image, gray)
             
             if len(faces) == 0:
                 return None
@@ -224,30 +475,39 @@ class EnhancedFaceRecognition:
             w = min(gray.shape[1] - x, w + 2*padding)
             h = min(gray.shape[0] - y, h + 2*padding)
             
-            uploaded_face = gray[y:y+h, x:x+w]
-            uploaded_face = cv2.resize(uploaded_face, (200, 200))
-            uploaded_face = cv2.equalizeHist(uploaded_face)
-            
-            # Compare with all stored faces
-            best_match = None
-            best_similarity = 0.0
-            
-            for student_id, data in self.face_data.items():
-                face_path = data['face_path']
-                if os.path.exists(face_path):
-                    stored_face = cv2.imread(face_path, cv2.IMREAD_GRAYSCALE)
-                    if stored_face is not None:
-                        similarity = self.calculate_face_similarity(uploaded_face, stored_face)
-                        
-                        if similarity > best_similarity and similarity > threshold:
-                            best_similarity = similarity
-                            best_match = {
-                                'student_id': student_id,
-                                'confidence': similarity * 100,  # Convert to percentage
-                                'similarity': similarity
-                            }
-            
-            return best_match
+            if self._ort is not None and self._embeddings:
+                # Cosine similarity against every stored embedding in one matmul
+                embeddings = self._get_embedding_matrix()
+                similarities = embeddings @ self._embed_faces([image[y:y+h, x:x+w]])[0]
+                student_ids = self._embedding_ids
+            else:
+                uploaded_face = gray[y:y+h, x:x+w]
+                uploaded_face = cv2.resize(uploaded_face, (200, 200))
+                uploaded_face = cv2.equalizeHist(uploaded_face)
+                
+                templates = self._get_template_matrix()
+                if templates is None:
+                    return None
+                
+                # Same-size TM_CCOEFF_NORMED is a Pearson correlation, so one GEMV scores every stored face;
+                # a zero-mean query makes centering the uint8 templates unnecessary
+                query = self._prepare_template(uploaded_face).astype(np.float32)
+                query -= query.mean()
+                query /= np.linalg.norm(query) + 1e-7
+                similarities = _uint8_matvec(templates, query) / self._template_norms
+                student_ids = self._template_ids
+            
+            best = int(similarities.argmax())
+            similarity = float(similarities[best])
+            
+            if similarity <= 0.0 or similarity <= threshold:
+                return None
+            
+            return {
+                'student_id': student_ids[best],
+                'confidence': similarity * 100,  # Convert to percentage
+                'similarity': similarity
+            }
             
         except Exception as e:
             logging.error(f"Error recognizing face: {e}")
@@ -269,25 +529,40 @@ class EnhancedFaceRecognition:
             'errors': []
         }
         
-        for student in students_data:
-            student_id = str(student['student_id'])
-            photo_url = student.get('photo_url')
-            name = student.get('name', 'Unknown')
-            
-            if not photo_url:
-                results['errors'].append(f"No photo URL for student {name} (ID: {student_id})")
-                results['failed'] += 1
-                continue
-            
-            results['processed'] += 1
-            
-            if self.extract_and_save_face(photo_url, student_id):
-                results['successful'] += 1
-                logging.info(f"✅ Processed {name} (ID: {student_id})")
-            else:
-                results['failed'] += 1
-                results['errors'].append(f"Failed to process {name} (ID: {student_id})")
-                logging.error(f"❌ Failed to process {name} (ID: {student_id})")
+        # Photos download concurrently a batch at a time; faces are extracted in order
+        # and the data files are written once at the end
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            for start in range(0, len(students_data), DOWNLOAD_BATCH_SIZE):
+                batch = students_data[start:start + DOWNLOAD_BATCH_SIZE]
+                images = executor.map(self.download_image_from_url,
+                                      [student.get('photo_url') for student in batch if student.get('photo_url')])
+                
+                for student in batch:
+                    student_id = str(student['student_id'])
+                    photo_url = student.get('photo_url')
+                    name = student.get('name', 'Unknown')
+                    
+                    if not photo_url:
+                        results['errors'].append(f"No photo URL for student {name} (ID: {student_id})")
+                        results['failed'] += 1
+                        continue
+                    
+                    results['processed'] += 1
+                    image = next(images)
+                    
+                    if image is not None and self.extract_and_save_face(photo_url, student_id, image, persist=False):
+                        results['successful'] += 1
+                        logging.info(f"✅ Processed {name} (ID: {student_id})")
+                    else:
+                        results['failed'] += 1
+                        results['errors'].append(f"Failed to process {name} (ID: {student_id})")
+                        logging.error(f"❌ Failed to process {name} (ID: {student_id})")
+        
+        if results['successful']:
+            self.save_face_data()
+            self.save_templates()
+            if self._ort is not None:
+                self.save_embeddings()
         
         return results
     
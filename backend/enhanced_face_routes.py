@@ -8,8 +8,6 @@ import shutil
 import cv2
 import numpy as np
 from pathlib import Path
-from PIL import Image
-import io
 
 from backend.database import get_db
 from backend.models import Student, Teacher, Attendance
@@ -38,11 +36,10 @@ async def recognize_face(
         # Read uploaded image
         contents = await file.read()
         
-        # Convert to OpenCV format
-        image = Image.open(io.BytesIO(contents))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        # Decode straight to OpenCV format (BGR)
+        opencv_image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+        if opencv_image is None:
+            raise ValueError("Could not decode image")
         
         # Recognize face
         recognition_result = enhanced_face_recognizer.recognize_face_from_image(opencv_image)
@@ -224,11 +221,10 @@ async def recognize_from_camera(
         # Read uploaded image
         contents = await file.read()
         
-        # Convert to OpenCV format
-        image = Image.open(io.BytesIO(contents))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        # Decode straight to OpenCV format (BGR)
+        opencv_image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+        if opencv_image is None:
+            raise ValueError("Could not decode image")
         
         # Recognize face
         recognition_result = enhanced_face_recognizer.recognize_face_from_image(opencv_image)
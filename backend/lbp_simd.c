@@ -0,0 +1,72 @@
+/*
+ * SIMD Local Binary Pattern kernel for AdvancedCNNFaceRecognition.calculate_lbp
+ *
+ * Build (loaded through ctypes when present, NumPy/Numba is used otherwise):
+ *     gcc -O3 -mavx2 -shared -fPIC -o backend/lbp_simd.so backend/lbp_simd.c
+ *
+ * xs/ys are the (n_points, rows) and (n_points, cols) neighbour lookup tables
+ * from _lbp_coordinates, so the output matches the Python implementation
+ * exactly. Within a 32-pixel span the column offset ys[p][j] - j is constant
+ * away from the left border, which lets each neighbour be one unaligned load.
+ */
+
+#include <stdint.h>
+
+#ifdef __AVX2__
+#include <immintrin.h>
+#endif
+
+static void lbp_scalar(const uint8_t *img, int rows, int cols,
+                       const int64_t *xs, const int64_t *ys, int n_points,
+                       int i, int j_start, int j_end, uint8_t *out)
+{
+    for (int j = j_start; j < j_end; j++) {
+        uint8_t center = img[(int64_t)i * cols + j];
+        unsigned pattern = 0;
+        for (int p = 0; p < n_points; p++) {
+            uint8_t neighbor = img[xs[(int64_t)p * rows + i] * cols + ys[(int64_t)p * cols + j]];
+            if (neighbor >= center)
+                pattern |= 1u << p;
+        }
+        out[(int64_t)i * cols + j] = (uint8_t)pattern;
+    }
+}
+
+void lbp_kernel(const uint8_t *img, int rows, int cols,
+                const int64_t *xs, const int64_t *ys, int n_points, int radius,
+                uint8_t *out)
+{
+    for (int i = radius; i < rows - radius; i++) {
+        int j = radius;
+
+#ifdef __AVX2__
+        const uint8_t *center_row = img + (int64_t)i * cols;
+        for (; j + 32 <= cols - radius; j += 32) {
+            __m256i center = _mm256_loadu_si256((const __m256i *)(center_row + j));
+            __m256i pattern = _mm256_setzero_si256();
+            int uniform = 1;
+
+            for (int p = 0; p < n_points; p++) {
+                const int64_t *ys_p = ys + (int64_t)p * cols;
+                int64_t offset = ys_p[j] - j;
+                if (ys_p[j + 31] - (j + 31) != offset) {
+                    uniform = 0;
+                    break;
+                }
+                const uint8_t *neighbor_row = img + xs[(int64_t)p * rows + i] * cols;
+                __m256i neighbor = _mm256_loadu_si256((const __m256i *)(neighbor_row + j + offset));
+                /* neighbor >= center  <=>  max(neighbor, center) == neighbor */
+                __m256i ge = _mm256_cmpeq_epi8(_mm256_max_epu8(neighbor, center), neighbor);
+                pattern = _mm256_or_si256(pattern, _mm256_and_si256(ge, _mm256_set1_epi8((char)(1u << p))));
+            }
+
+            if (uniform)
+                _mm256_storeu_si256((__m256i *)(out + (int64_t)i * cols + j), pattern);
+            else
+                lbp_scalar(img, rows, cols, xs, ys, n_points, i, j, j + 32, out);
+        }
+#endif
+
+        lbp_scalar(img, rows, cols, xs, ys, n_points, i, j, cols - radius, out);
+    }
+}
@@ -1,7 +1,7 @@
 """
 SQLAlchemy ORM Models for Attendance Management System
 """
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Date, Numeric, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Date, Numeric, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from backend.database import Base
@@ -100,7 +100,13 @@ class Attendance(Base):
     notes = Column(Text)
     
     # Unique constraint - one attendance record per student per day
-    __table_args__ = (UniqueConstraint('student_id', 'attendance_date', name='uq_student_date'),)
+    # Covering index so date-range status aggregates in analytics are index-only scans;
+    # teacher/date index serves the per-teacher daily statistics
+    __table_args__ = (
+        UniqueConstraint('student_id', 'attendance_date', name='uq_student_date'),
+        Index('ix_att_date_status', 'attendance_date', 'status', postgresql_include=['student_id']),
+        Index('ix_att_teacher_date_stu', 'teacher_id', 'attendance_date', 'student_id'),
+    )
     
     # Relationships
     student = relationship("Student", back_populates="attendance_records")
@@ -2,7 +2,7 @@
 New database models with string IDs and proper teacher isolation
 Designed for real attendance registry system
 """
-from sqlalchemy import Column, String, Text, Boolean, DateTime, Date, Time, ForeignKey
+from sqlalchemy import Column, String, Text, Boolean, DateTime, Date, Time, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime, date
@@ -32,6 +32,10 @@ class Teacher(Base):
 class Class(Base):
     """Class model with string-based ID and teacher isolation"""
     __tablename__ = "classes"
+    __table_args__ = (
+        # Teacher scoping filters every student lookup through classes
+        Index('ix_classes_teacher', 'teacher_id'),
+    )
     
     class_id = Column(String(50), primary_key=True)  # String ID like "MECH_3_A", "CS_3_B"
     class_name = Column(String(100), nullable=False)  # "Mechanical", "Computer Science"
@@ -51,6 +55,10 @@ class Class(Base):
 class Student(Base):
     """Student model with string-based ID and teacher isolation"""
     __tablename__ = "students"
+    __table_args__ = (
+        # Join from a teacher's classes to their active students
+        Index('ix_students_class_active', 'class_id', 'is_active'),
+    )
     
     student_id = Column(String(50), primary_key=True)  # String ID like "STU_4001", "MECH_4001"
     roll_number = Column(String(20), nullable=False)
@@ -86,6 +94,11 @@ class Student(Base):
 class AttendanceRecord(Base):
     """Date-wise attendance records like real registry"""
     __tablename__ = "attendance_records"
+    __table_args__ = (
+        # Covers the class/date-range filters and status aggregates of the reports
+        Index('ix_att_class_date_status', 'class_id', 'attendance_date', 'status',
+              postgresql_include=['student_id']),
+    )
     
     record_id = Column(String(100), primary_key=True)  # "MECH_2025-09-13_STU_4001"
     student_id = Column(String(50), ForeignKey("students.student_id"), nullable=False)
@@ -6,11 +6,37 @@ import numpy as np
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from PIL import Image
-from io import BytesIO
 import logging
 from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Concurrent photo downloads in process_all_students_from_db
+DOWNLOAD_WORKERS = 32
+DOWNLOAD_BATCH_SIZE = 128
+
+def _build_http_session() -> requests.Session:
+    """Shared session so photo downloads reuse pooled keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS,
+                          max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_HTTP = _build_http_session()
+
+@lru_cache(maxsize=None)
+def _lbp_coordinates(radius: int, n_points: int, rows: int, cols: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Neighbour row/col lookup tables for an LBP ring, shape (n_points, rows) and (n_points, cols)"""
+    angles = 2 * np.pi * np.arange(n_points) / n_points
+    # int(i + radius * cos(angle)) per row/col so float rounding matches the per-pixel loop
+    xs = (np.arange(rows)[None, :] + radius * np.cos(angles)[:, None]).astype(np.int64)
+    ys = (np.arange(cols)[None, :] + radius * np.sin(angles)[:, None]).astype(np.int64)
+    return np.clip(xs, 0, rows - 1), np.clip(ys, 0, cols - 1)
 
 class EnhancedFaceRecognition:
     def __init__(self, faces_dir: str = "faces"):
@@ -21,8 +47,16 @@ class EnhancedFaceRecognition:
         self.face_data = {}
         self.face_features = {}
         
-        # Initialize OpenCV face detector
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # Initialize OpenCV face detector: YuNet when its model file is present, Haar cascade otherwise
+        self.face_detector_file = self.faces_dir / "face_detection_yunet.onnx"
+        self.face_detector = None
+        if self.face_detector_file.exists():
+            try:
+                self.face_detector = cv2.FaceDetectorYN.create(str(self.face_detector_file), "", (320, 320))
+            except Exception as e:
+                logging.warning(f"YuNet face detector unavailable, using Haar cascade: {e}")
+        if self.face_detector is None:
+            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
         
         self.load_face_data()
         self.load_face_features()
@@ -67,19 +101,33 @@ class EnhancedFaceRecognition:
         except Exception as e:
             logging.error(f"Error saving face features: {e}")
     
+    def detect_faces(self, image: np.ndarray, gray: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Detect faces as (x, y, w, h) boxes in a BGR image (gray is its grayscale copy)"""
+        if self.face_detector is None:
+            return list(self.face_cascade.detectMultiScale(gray, 1.1, 4))
+        
+        height, width = gray.shape
+        self.face_detector.setInputSize((width, height))
+        _, faces = self.face_detector.detect(image)
+        if faces is None:
+            return []
+        
+        # YuNet boxes can extend past the frame; clip them to the image
+        boxes = []
+        for x, y, w, h in faces[:, :4].astype(int).tolist():
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 > x0 and y1 > y0:
+                boxes.append((x0, y0, x1 - x0, y1 - y0))
+        return boxes
+    
     def download_image_from_url(self, url: str) -> Optional[np.ndarray]:
         """Download image from URL and convert to OpenCV format"""
         try:
-            response = requests.get(url, timeout=10)
+            response = _HTTP.get(url, timeout=10)
             if response.status_code == 200:
-                # Convert to PIL Image first
-                image = Image.open(BytesIO(response.content))
-                # Convert to RGB if needed
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                # Convert to OpenCV format (BGR)
-                opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                return opencv_image
+                # Decode straight to BGR (None if the bytes are not an image)
+                return cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
             return None
         except Exception as e:
             logging.error(f"Error downloading image from {url}: {e}")
@@ -137,24 +185,16 @@ class EnhancedFaceRecognition:
         try:
             rows, cols = image.shape
             lbp = np.zeros((rows, cols), dtype=np.uint8)
+            xs, ys = _lbp_coordinates(radius, n_points, rows, cols)
+            inner_rows = slice(radius, rows - radius)
+            inner_cols = slice(radius, cols - radius)
+            center = image[inner_rows, inner_cols]
+            pattern = lbp[inner_rows, inner_cols]
             
-            for i in range(radius, rows - radius):
-                for j in range(radius, cols - radius):
-                    center = image[i, j]
-                    pattern = 0
-                    
-                    for p in range(n_points):
-                        # Calculate neighbor coordinates
-                        angle = 2 * np.pi * p / n_points
-                        x = int(i + radius * np.cos(angle))
-                        y = int(j + radius * np.sin(angle))
-                        
-                        # Compare with center
-                        if x >= 0 and x < rows and y >= 0 and y < cols:
-                            if image[x, y] >= center:
-                                pattern |= (1 << p)
-                    
-                    lbp[i, j] = pattern
+            # One array comparison per neighbour instead of a per-pixel loop
+            for p in range(n_points):
+                neighbors = image[np.ix_(xs[p, inner_rows], ys[p, inner_cols])]
+                pattern |= (neighbors >= center).astype(np.uint8) << p
             
             return lbp
             
@@ -189,11 +229,13 @@ class EnhancedFaceRecognition:
             logging.error(f"Error calculating feature similarity: {e}")
             return 0.0
     
-    def extract_and_save_face(self, photo_url: str, student_id: str) -> bool:
-        """Extract face from Google Drive URL and save features"""
+    def extract_and_save_face(self, photo_url: str, student_id: str,
+                              image: Optional[np.ndarray] = None, persist: bool = True) -> bool:
+        """Extract face from Google Drive URL (or an already downloaded image) and save features"""
         try:
             # Download image
-            image = self.download_image_from_url(photo_url)
+            if image is None:
+                image = self.download_image_from_url(photo_url)
             if image is None:
                 return False
             
@@ -201,7 +243,7 @@ class EnhancedFaceRecognition:
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             
             # Detect faces
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            faces = self.detect_faces(image, gray)
             
             if len(faces) == 0:
                 logging.warning(f"No faces found in image for student {student_id}")
@@ -237,8 +279,9 @@ class EnhancedFaceRecognition:
             }
             self.face_features[student_id] = features
             
-            self.save_face_data()
-            self.save_face_features()
+            if persist:
+                self.save_face_data()
+                self.save_face_features()
             
             logging.info(f"Successfully extracted features for student {student_id}")
             return True
@@ -254,7 +297,7 @@ class EnhancedFaceRecognition:
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             
             # Detect faces
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            faces = self.detect_faces(image, gray)
             
             if len(faces) == 0:
                 return None
@@ -314,25 +357,38 @@ class EnhancedFaceRecognition:
             'errors': []
         }
         
-        for student in students_data:
-            student_id = str(student['student_id'])
-            photo_url = student.get('photo_url')
-            name = student.get('name', 'Unknown')
-            
-            if not photo_url:
-                results['errors'].append(f"No photo URL for student {name} (ID: {student_id})")
-                results['failed'] += 1
-                continue
-            
-            results['processed'] += 1
-            
-            if self.extract_and_save_face(photo_url, student_id):
-                results['successful'] += 1
-                logging.info(f"✅ Processed {name} (ID: {student_id})")
-            else:
-                results['failed'] += 1
-                results['errors'].append(f"Failed to process {name} (ID: {student_id})")
-                logging.error(f"❌ Failed to process {name} (ID: {student_id})")
+        # Photos download concurrently a batch at a time; faces are extracted in order
+        # and the data files are written once at the end
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            for start in range(0, len(students_data), DOWNLOAD_BATCH_SIZE):
+                batch = students_data[start:start + DOWNLOAD_BATCH_SIZE]
+                images = executor.map(self.download_image_from_url,
+                                      [student.get('photo_url') for student in batch if student.get('photo_url')])
+                
+                for student in batch:
+                    student_id = str(student['student_id'])
+                    photo_url = student.get('photo_url')
+                    name = student.get('name', 'Unknown')
+                    
+                    if not photo_url:
+                        results['errors'].append(f"No photo URL for student {name} (ID: {student_id})")
+                        results['failed'] += 1
+                        continue
+                    
+                    results['processed'] += 1
+                    image = next(images)
+                    
+                    if image is not None and self.extract_and_save_face(photo_url, student_id, image, persist=False):
+                        results['successful'] += 1
+                        logging.info(f"✅ Processed {name} (ID: {student_id})")
+                    else:
+                        results['failed'] += 1
+                        results['errors'].append(f"Failed to process {name} (ID: {student_id})")
+                        logging.error(f"❌ Failed to process {name} (ID: {student_id})")
+        
+        if results['successful']:
+            self.save_face_data()
+            self.save_face_features()
         
         return results
     
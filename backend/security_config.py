@@ -0,0 +1,106 @@
+"""
+Shared password hashing, token decoding and teacher caching for the authentication modules
+"""
+import hashlib
+import secrets
+import threading
+import time
+from cachetools import TTLCache
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError
+from passlib.context import CryptContext
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+# argon2id for new hashes; bcrypt hashes still verify and are rehashed on login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default="argon2",
+    argon2__memory_cost=19456,
+    argon2__time_cost=2,
+    argon2__parallelism=1,
+    bcrypt__default_rounds=10,
+    deprecated="auto"
+)
+
+# Successful password verifications, so repeat logins skip the KDF.
+# Failures are never cached and always pay the full hashing cost; keys are
+# keyed with a per-process secret so plaintexts can't be recovered from memory.
+_verified_passwords = TTLCache(maxsize=1024, ttl=300)
+_verified_passwords_key = secrets.token_bytes(32)
+_verified_passwords_lock = threading.Lock()
+
+# Decoded JWT payloads keyed by signing key and token digest, and recently resolved
+# teachers. Cached payloads are still checked against their own "exp" on every hit.
+_token_cache = TTLCache(maxsize=4096, ttl=60)
+_teacher_cache = TTLCache(maxsize=1024, ttl=30)
+_auth_cache_lock = threading.Lock()
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash"""
+    key = hashlib.blake2b(
+        plain_password.encode() + b"|" + hashed_password.encode(), digest_size=16,
+        key=_verified_passwords_key
+    ).digest()
+    with _verified_passwords_lock:
+        if key in _verified_passwords:
+            return True
+    
+    verified = pwd_context.verify(plain_password, hashed_password)
+    if verified:
+        with _verified_passwords_lock:
+            _verified_passwords[key] = True
+    return verified
+
+
+def get_password_hash(password: str) -> str:
+    """Hash a password"""
+    return pwd_context.hash(password)
+
+
+def decode_token(token: str, secret_key: str, algorithm: str) -> dict:
+    """Decode a JWT, reusing the payload of recently verified tokens"""
+    key = hashlib.blake2b(secret_key.encode() + b"|" + token.encode(), digest_size=16).digest()
+    with _auth_cache_lock:
+        payload = _token_cache.get(key)
+    
+    if payload is None:
+        payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+        with _auth_cache_lock:
+            _token_cache[key] = payload
+    elif payload.get("exp") is not None and payload["exp"] <= time.time():
+        raise ExpiredSignatureError("Signature has expired.")
+    
+    return payload
+
+
+def get_teacher_cached(db: Session, column, value):
+    """Look up a teacher by a unique column, attaching a recently loaded copy to this session when cached"""
+    model = column.class_
+    cache_key = (model, column.key, value)
+    with _auth_cache_lock:
+        cached = _teacher_cache.get(cache_key)
+    if cached is not None:
+        return db.merge(cached, load=False)
+    
+    teacher = db.query(model).filter(column == value).first()
+    if teacher is not None:
+        # Cache a detached column snapshot, never the instance owned by this session
+        snapshot = model(**{attr.key: getattr(teacher, attr.key) for attr in inspect(model).column_attrs})
+        make_transient_to_detached(snapshot)
+        with _auth_cache_lock:
+            _teacher_cache[cache_key] = snapshot
+    return teacher
+
+
+def evict_cached_teacher(teacher) -> None:
+    """Drop cached snapshots of a teacher after their row changes (update, deactivation)"""
+    model = type(teacher)
+    with _auth_cache_lock:
+        stale = [
+            key for key, snapshot in _teacher_cache.items()
+            if key[0] is model and snapshot.teacher_id == teacher.teacher_id
+        ]
+        for key in stale:
+            _teacher_cache.pop(key, None)
@@ -79,7 +79,15 @@ CREATE INDEX idx_teachers_email ON teachers(email);
 CREATE INDEX idx_students_roll_number ON students(roll_number);
 CREATE INDEX idx_attendance_date ON attendance(attendance_date);
 CREATE INDEX idx_attendance_student_date ON attendance(student_id, attendance_date);
-CREATE INDEX idx_attendance_class_date ON attendance(class_id, attendance_date);
+CREATE INDEX idx_attendance_class_date_status ON attendance(class_id, attendance_date, status) INCLUDE (student_id);
+CREATE INDEX idx_attendance_teacher_date_student ON attendance(teacher_id, attendance_date, student_id);
+
+-- Existing databases:
+--   DROP INDEX IF EXISTS idx_attendance_class_date;
+--   CREATE INDEX CONCURRENTLY idx_attendance_class_date_status
+--       ON attendance(class_id, attendance_date, status) INCLUDE (student_id);
+--   CREATE INDEX CONCURRENTLY idx_attendance_teacher_date_student
+--       ON attendance(teacher_id, attendance_date, student_id);
 
 -- Insert sample data for testing
 INSERT INTO teachers (name, email, password_hash, department) VALUES 
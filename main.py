@@ -4,11 +4,12 @@ FastAPI main application with all routes and endpoints
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
 from fastapi.security import HTTPBearer
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date, timedelta
+import asyncio
 import os
 import shutil
 from pathlib import Path
@@ -24,7 +25,7 @@ from backend.analytics import (
     generate_attendance_report, generate_daily_attendance_trends,
     generate_class_wise_summary, get_top_performers, 
     get_students_needing_attention, export_attendance_to_excel,
-    get_monthly_attendance_summary
+    get_monthly_attendance_summary, get_attendance_extremes
 )
 from decouple import config
 
@@ -35,7 +36,8 @@ Base.metadata.create_all(bind=engine)
 app = FastAPI(
     title="Attendance Management System",
     description="A comprehensive attendance management system with facial recognition",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware for frontend integration
@@ -431,7 +433,8 @@ async def register_teacher(teacher: TeacherCreate, db: Session = Depends(get_db)
             detail="Teacher with this email already exists"
         )
     
-    db_teacher = create_teacher(db, teacher)
+    # Password hashing is CPU-heavy; keep it off the event loop
+    db_teacher = await asyncio.to_thread(create_teacher, db, teacher)
     return db_teacher
 
 
@@ -986,6 +989,18 @@ async def get_students_attention_needed(
     return {"students_needing_attention": students}
 
 
+@app.get("/analytics/extremes")
+async def get_attendance_extremes_endpoint(
+    limit: int = 10,
+    threshold: float = 75.0,
+    class_id: Optional[int] = None,
+    current_teacher: Teacher = Depends(get_current_teacher),
+    db: Session = Depends(get_db)
+):
+    """Get top performers and students needing attention together"""
+    return get_attendance_extremes(db, limit, threshold, class_id)
+
+
 @app.get("/analytics/export/excel")
 async def export_attendance_excel(
     class_id: Optional[int] = None,
@@ -4,11 +4,12 @@ New FastAPI main application with string-based IDs and proper teacher isolation
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
 from fastapi.security import HTTPBearer
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, FileResponse, ORJSONResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date, timedelta
+import asyncio
 import os
 import shutil
 from pathlib import Path
@@ -29,7 +30,8 @@ Base.metadata.create_all(bind=engine)
 app = FastAPI(
     title="Enhanced Attendance Management System",
     description="A comprehensive attendance management system with teacher isolation and string-based IDs",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -80,7 +82,8 @@ async def register_teacher(teacher: TeacherCreate, db: Session = Depends(get_db)
         )
     
     # Create new teacher
-    db_teacher = create_teacher(db, teacher)
+    # Password hashing is CPU-heavy; keep it off the event loop
+    db_teacher = await asyncio.to_thread(create_teacher, db, teacher)
     return db_teacher
 
 
@@ -171,7 +174,8 @@ async def upload_students_csv(
         tmp_file_path = tmp_file.name
     
     try:
-        # Import students for this teacher
+        # Import students for this teacher; csv_import works on backend.models, so it
+        # opens its own backend.database session rather than sharing this database_new one
         result = import_students_from_csv(tmp_file_path, current_teacher.teacher_id)
         
         if result['success']:
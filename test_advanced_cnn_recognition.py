@@ -0,0 +1,78 @@
+"""
+Tests for backend.advanced_cnn_recognition
+"""
+import cv2
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def recognizer(tmp_path, monkeypatch):
+    """Recognizer whose data files and face images live in a temporary directory"""
+    monkeypatch.chdir(tmp_path)
+    from backend.advanced_cnn_recognition import AdvancedCNNFaceRecognition
+    return AdvancedCNNFaceRecognition(faces_dir=str(tmp_path / 'cnn_faces'))
+
+
+def test_enrollment_and_query_embeddings_match(recognizer, monkeypatch):
+    """bulk_enroll and recognition embed the same photo to the same vector"""
+    pytest.importorskip('deepface')
+    if recognizer._df_model is None:
+        pytest.skip('DeepFace model could not be built')
+    image = np.random.default_rng(0).integers(0, 255, (224, 224, 3), dtype=np.uint8)
+    monkeypatch.setattr(recognizer, 'download_image_from_url', lambda url: image)
+
+    assert recognizer.bulk_enroll([('photo.jpg', '1')]) == {'1': True}
+
+    query = recognizer.normalize_encoding(recognizer.extract_cnn_features(image))
+    np.testing.assert_allclose(recognizer.face_encodings['1'], query, atol=1e-5)
+
+
+def test_lbp_fallback_scores_every_enrolled_student(recognizer, monkeypatch):
+    """When the CNN cannot embed a query, LBP compares it with all students and keeps the true one"""
+    from backend import advanced_cnn_recognition
+    monkeypatch.setattr(advanced_cnn_recognition, 'DEEPFACE_AVAILABLE', True)
+    monkeypatch.setattr(recognizer, 'extract_cnn_features', recognizer.extract_fallback_features)
+    monkeypatch.setattr(recognizer, 'get_student_details', lambda student_id: None)
+
+    rng = np.random.default_rng(0)
+    faces = {}
+    for student_id in map(str, range(8)):
+        noise = rng.integers(0, 255, (224, 224), dtype=np.uint8)
+        faces[student_id] = cv2.cvtColor(cv2.GaussianBlur(noise, (0, 0), 1 + int(student_id)), cv2.COLOR_GRAY2BGR)
+        cv2.imwrite(str(recognizer._face_path(student_id)), faces[student_id])
+        recognizer.face_encodings[student_id] = recognizer.normalize_encoding(rng.random(128))  # CNN-sized
+    recognizer._rebuild_matrix()
+
+    result = recognizer.recognize_face_from_image(faces['5'])
+
+    assert set(result['all_similarities']) == set(faces)
+    assert max(result['all_similarities'], key=result['all_similarities'].get) == '5'
+
+
+def test_batch_recognition_embeds_all_faces_in_one_pass(recognizer, monkeypatch):
+    """recognize_faces_batch runs one forward pass and reports faceless uploads individually"""
+    from backend import advanced_cnn_recognition
+    monkeypatch.setattr(advanced_cnn_recognition, 'DEEPFACE_AVAILABLE', True)
+    monkeypatch.setattr(recognizer, '_df_model', object())
+    monkeypatch.setattr(recognizer, 'get_student_details', lambda student_id: None)
+
+    rng = np.random.default_rng(0)
+    gallery = {str(i): recognizer.normalize_encoding(rng.random(128)) for i in range(4)}
+    recognizer.face_encodings.update(gallery)
+    recognizer._rebuild_matrix()
+
+    # Each "image" is a key into the gallery; an empty image has no face
+    images = [np.full((4, 4, 3), i, dtype=np.uint8) for i in (2, 0)] + [np.zeros((0, 0, 3), dtype=np.uint8)]
+    monkeypatch.setattr(recognizer, '_prepare_face', lambda image: image[0, 0] if image.size else None)
+    passes = []
+    def embed(faces):
+        passes.append(len(faces))
+        return np.stack([gallery[str(face[0])] for face in faces])
+    monkeypatch.setattr(recognizer, '_embed_faces', embed)
+
+    results = recognizer.recognize_faces_batch(images)
+
+    assert passes == [2]
+    assert [result.get('student_id') for result in results] == ['2', '0', None]
+    assert results[2]['reason'] == 'Could not extract face features from uploaded image'
@@ -0,0 +1,110 @@
+"""
+Tests for backend.analytics against an in-memory SQLite database
+"""
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from backend.database import Base
+from backend.models import Teacher, Student, Class, StudentClass, Attendance
+from backend import analytics
+
+
+@pytest.fixture
+def db():
+    """Session on a fresh in-memory database with two students in one class"""
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        teacher = Teacher(name='Teacher', email='teacher@example.com', password_hash='x')
+        session.add(teacher)
+        session.flush()
+
+        school_class = Class(class_name='10', section='A', subject='Math', teacher_id=teacher.teacher_id)
+        session.add(school_class)
+        session.flush()
+
+        today = date.today()
+        for roll_number, statuses in (('R1', ['Present'] * 6), ('R2', ['Present', 'Absent'] * 3)):
+            student = Student(roll_number=roll_number, name=f'Student {roll_number}', class_name='10',
+                              section='A', branch='CS', teacher_id=teacher.teacher_id)
+            session.add(student)
+            session.flush()
+            session.add(StudentClass(student_id=student.student_id, class_id=school_class.class_id))
+            for days_ago, status in enumerate(statuses, start=1):
+                session.add(Attendance(student_id=student.student_id, teacher_id=teacher.teacher_id,
+                                       status=status, attendance_date=today - timedelta(days=days_ago)))
+        session.commit()
+
+        session.info['class_id'] = school_class.class_id
+        yield session
+
+    engine.dispose()
+
+
+def test_generate_attendance_report(db):
+    """The report derives each student's class through their enrollment"""
+    report = analytics.generate_attendance_report(db, class_id=db.info['class_id'])
+
+    rows = {row['roll_number']: row for row in report['student_data']}
+    assert rows['R1']['total_days'] == 6 and rows['R1']['attendance_percentage'] == 100.0
+    assert rows['R2']['present_days'] == 3 and rows['R2']['attendance_percentage'] == 50.0
+    assert report['summary_statistics']['total_students'] == 2
+    assert report['summary_statistics']['students_with_low_attendance'] == 1
+
+
+def test_daily_trends_reflect_corrected_marks(db):
+    """A mark corrected after the day has passed shows up in the next trends query"""
+    yesterday = date.today() - timedelta(days=1)
+    before = analytics.generate_daily_attendance_trends(db, db.info['class_id'], days=7)
+    assert before['present_count'][before['dates'].index(yesterday.isoformat())] == 2
+
+    absent = db.query(Attendance).filter(Attendance.attendance_date == yesterday).first()
+    absent.status = 'Absent'
+    db.commit()
+
+    after = analytics.generate_daily_attendance_trends(db, db.info['class_id'], days=7)
+    assert after['present_count'][after['dates'].index(yesterday.isoformat())] == 1
+
+
+def test_rankings_order_and_deficit(db):
+    """Top performers come best first and the attention list carries each deficit"""
+    top = analytics.get_top_performers(db, limit=1, class_id=db.info['class_id'])
+    assert [row['roll_number'] for row in top] == ['R1']
+
+    attention = analytics.get_students_needing_attention(db, threshold=75.0)
+    assert [row['roll_number'] for row in attention] == ['R2']
+    assert attention[0]['deficit_percentage'] == 25.0
+
+
+def test_export_attendance_to_excel_keeps_every_cell(db):
+    """Every row of the exported sheets reads back complete"""
+    excel = analytics.export_attendance_to_excel(db, class_id=db.info['class_id'])
+    sheets = pd.read_excel(excel, sheet_name=None)
+
+    students = sheets['Student Attendance'].set_index('roll_number')
+    assert students.notna().all().all()
+    assert students.loc['R1', 'present_days'] == 6 and students.loc['R2', 'absent_days'] == 3
+    assert list(sheets['Low Attendance']['roll_number']) == ['R2']
+
+    trends = sheets['Daily Trends']
+    assert trends.notna().all().all()
+    assert trends['present_count'].sum() == 9 and trends['absent_count'].sum() == 3
+
+
+def test_attendance_extremes_in_one_query(db):
+    """Both slices come from a single statement execution and match the separate rankings"""
+    statements = []
+    event.listen(db.get_bind(), 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    extremes = analytics.get_attendance_extremes(db, limit=1, threshold=75.0, class_id=db.info['class_id'])
+
+    assert len(statements) == 1
+    assert [row['roll_number'] for row in extremes['top_performers']] == ['R1']
+    assert [row['roll_number'] for row in extremes['students_needing_attention']] == ['R2']
+    assert extremes['students_needing_attention'][0]['deficit_percentage'] == 25.0
@@ -0,0 +1,37 @@
+"""
+Tests for backend.crud against an in-memory SQLite database
+"""
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from backend.database import Base
+from backend.models import Teacher
+from backend.auth import get_teacher_cached
+from backend import crud
+
+
+@pytest.fixture
+def engine():
+    """Fresh in-memory database with one teacher"""
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Teacher(name='Teacher', email='reuse@example.com', password_hash='x'))
+        session.commit()
+    yield engine
+    engine.dispose()
+
+
+def test_get_teacher_by_id_reuses_the_authenticated_teacher(engine):
+    """Once authentication has resolved the teacher in a request session, the id lookup issues no SQL"""
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    for _ in range(2):  # First request loads the teacher, the second attaches the cached snapshot
+        with Session(engine) as db:
+            teacher = get_teacher_cached(db, Teacher.email, 'reuse@example.com')
+            statements.clear()
+            assert crud.get_teacher_by_id(db, teacher.teacher_id) is teacher
+            assert statements == []